@@ -1,3 +1,7 @@
-# Expose just the pack and unpack public functions
-from h5pack.h5pack import pack, unpack
+# Expose just the public functions
+from h5pack.h5pack import pack, unpack, packb, unpackb, open
+from h5pack.writer import Writer
+from h5pack.shard import pack_sharded
+from h5pack.batch import pack_many, unpack_many
+from h5pack.edit import update, delete, repack
 from .version import __version__
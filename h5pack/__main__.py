@@ -0,0 +1,27 @@
+"""Command line tools. Usage:
+    python -m h5pack repack FILENAME [OUT_FILENAME]
+"""
+import argparse
+import sys
+
+from h5pack.edit import repack
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m h5pack', description='h5pack command line tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    repack_parser = subparsers.add_parser('repack', help='Copy a pack into a fresh file to free space left unused '
+                                                         'by update/delete')
+    repack_parser.add_argument('filename')
+    repack_parser.add_argument('out_filename', nargs='?', help='File to write (default: replace filename)')
+
+    args = parser.parse_args()
+    if args.command == 'repack':
+        repack(args.filename, args.out_filename)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
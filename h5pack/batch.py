@@ -0,0 +1,133 @@
+"""Packing and unpacking many files at once in a pool of worker processes, which is kept running between calls so
+that each pack/unpack only pays for itself. Processes are used instead of threads because h5py only lets 1 thread
+into HDF5 at a time.
+"""
+import itertools
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from h5pack.h5pack import pack, unpack
+
+# Number of processes -> running ProcessPoolExecutor
+pools = {}
+
+
+def get_pool(processes):
+    """The running pool of processes worker processes, started if it isn't already"""
+    pool = pools.get(processes)
+    if pool is None:
+        # Spawn instead of fork, since HDF5 isn't fork safe with files open
+        pool = pools[processes] = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'))
+    return pool
+
+
+def shutdown():
+    """Stop the worker processes of pack_many and unpack_many. They're also stopped at exit."""
+    for pool in pools.values():
+        pool.shutdown()
+    pools.clear()
+
+
+def pack_chunk(chunk, options):
+    """Pack each (data, filename) in chunk, returning (filename, error) for each"""
+    results = []
+    for data, filename in chunk:
+        try:
+            pack(data, filename, **options)
+            results.append((filename, None))
+        except Exception as e:
+            results.append((filename, e))
+    return results
+
+
+def unpack_chunk(chunk, options):
+    """Unpack each filename in chunk, returning (filename, data, error) for each"""
+    results = []
+    for filename in chunk:
+        try:
+            results.append((filename, unpack(filename, **options), None))
+        except Exception as e:
+            results.append((filename, None, e))
+    return results
+
+
+def run_many(f, args, options, processes, chunksize, failed):
+    """Yield the results of f(chunk, options) for chunks of chunksize args each as they finish, run in the pool of
+    processes worker processes, or in order in this process if processes is None. failed(arg, error) makes the result
+    for an arg whose chunk couldn't be run.
+    """
+    if not processes:
+        for arg in args:
+            yield from f([arg], options)
+        return
+
+    options = {k: v for k, v in options.items() if k != 'stats'}  # Would be filled in the workers' copies
+    args = iter(args)
+    futures = {}
+    while True:
+        # Keep a few chunks queued per worker, so that args can be a generator of more than fits in memory
+        while len(futures) < 2 * processes:
+            chunk = list(itertools.islice(args, chunksize))
+            if not chunk:
+                break
+            futures[get_pool(processes).submit(f, chunk, options)] = chunk
+        if not futures:
+            return
+
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            chunk = futures.pop(future)
+            try:
+                yield from future.result()
+            except Exception as e:  # Chunk couldn't be sent to or back from the worker, or the worker died
+                if isinstance(e, BrokenProcessPool):
+                    pools.pop(processes, None)  # Start a new pool for the rest
+                for arg in chunk:
+                    yield failed(arg, e)
+
+
+def paired(items, filenames):
+    """zip items and filenames, raising ValueError if one runs out before the other"""
+    end = object()
+    for data, filename in itertools.zip_longest(items, filenames, fillvalue=end):
+        if data is end or filename is end:
+            raise ValueError('items and filenames have different lengths')
+        yield data, filename
+
+
+def pack_many(items, filenames, processes=None, chunksize=1, **options):
+    """Pack each of items into the filename at the same position in filenames, in parallel worker processes. Yields
+    (filename, error) as each one finishes, with error the exception raised packing it, or None if it was packed.
+
+    Nothing is packed until the results are iterated over, so always consume them, like with a for loop or
+    list(pack_many(...)), even if they're not needed.
+
+    Args:
+        items: iterable of data to pack, like for pack
+        filenames: iterable of str, names of files to save, as many as items. If either has a length, they're
+            checked right away; otherwise ValueError is raised when one runs out first.
+        processes: int, number of worker processes, or None to pack in order in this process. The processes are
+            started the 1st time and kept running for later calls (until shutdown()), so call this from under
+            if __name__ == '__main__' in scripts. Items and options are pickled to send to them, so the policy option
+            has to be picklable, and the stats option is ignored.
+        chunksize: int, number of items to send to a worker at a time, which cuts the overhead for small items
+        options: Same options as pack
+    """
+    if hasattr(items, '__len__') and hasattr(filenames, '__len__') and len(items) != len(filenames):
+        raise ValueError('Got {} items but {} filenames'.format(len(items), len(filenames)))
+    return run_many(pack_chunk, paired(items, filenames), options, processes, chunksize, lambda arg, e: (arg[1], e))
+
+
+def unpack_many(filenames, processes=None, chunksize=1, **options):
+    """Unpack each file in filenames, in parallel worker processes. Yields (filename, data, error) as each one
+    finishes, with data None and error the exception raised if it couldn't be unpacked, or error None if it was.
+    Nothing is unpacked until the results are iterated over.
+
+    Args:
+        filenames: iterable of str, names of files to unpack
+        processes: int, number of worker processes, or None to unpack in order in this process. See pack_many.
+        chunksize: int, number of files to send to a worker at a time
+        options: Same options as unpack, except lazy
+    """
+    return run_many(unpack_chunk, filenames, options, processes, chunksize, lambda arg, e: (arg, None, e))
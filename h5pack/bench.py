@@ -0,0 +1,278 @@
+"""Benchmarks of pack/unpack speed, memory use, and file size over representative workloads and options. Usage:
+    python -m h5pack.bench [--workloads NAME,...] [--configs NAME,...] [--scale SCALE] [--repeat N] [--json FILENAME]
+
+Each pack and each unpack runs in a fresh process (unless --no-isolate), so its peak RSS isn't hidden by earlier runs.
+Pack's peak RSS includes the data being packed. Throughput is in MB/s of in-memory data (see payload_bytes) and in
+objects/s (see count_objects). Use --json to save the results for comparing runs.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from h5pack.h5pack import pack, unpack
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def scaled(n, scale):
+    return max(1, int(n * scale))
+
+
+def big_array(scale):
+    """1 large float64 array, 128 MB at scale 1"""
+    return np.random.default_rng(0).random(scaled(2 ** 24, scale))
+
+
+def many_arrays(scale):
+    """Dict of 10000 small float32 arrays of different lengths"""
+    rng = np.random.default_rng(0)
+    return {'a{}'.format(i): rng.random(rng.integers(10, 200)).astype(np.float32) for i in range(scaled(10000, scale))}
+
+
+def list_int(scale):
+    """1e6 ints"""
+    return np.random.default_rng(0).integers(-10 ** 6, 10 ** 6, scaled(10 ** 6, scale)).tolist()
+
+
+def list_float(scale):
+    """1e6 floats"""
+    return np.random.default_rng(0).random(scaled(10 ** 6, scale)).tolist()
+
+
+def list_str(scale):
+    """1e6 short strs"""
+    return ['item{}'.format(i) for i in range(scaled(10 ** 6, scale))]
+
+
+def list_bool(scale):
+    """1e6 bools"""
+    return (np.random.default_rng(0).random(scaled(10 ** 6, scale)) < 0.5).tolist()
+
+
+def deep_tree(scale):
+    """Heterogeneous dicts nested 5 deep with 4 subtrees each, over heterogeneous lists with a small array"""
+    rng = np.random.default_rng(0)
+
+    def subtree(depth):
+        if depth == 0:
+            return [1, 'leaf', 2.5, None, rng.random(8)]
+        node = {'k{}'.format(i): subtree(depth - 1) for i in range(4)}
+        node['depth'] = depth
+        node['name'] = 'level{}'.format(depth)
+        return node
+
+    return [subtree(4) for _ in range(scaled(8, scale))]
+
+
+def records(scale):
+    """List of 1e5 dicts with the same keys"""
+    rng = np.random.default_rng(0)
+    xs = rng.random(scaled(10 ** 5, scale)).tolist()
+    return [{'id': i, 'x': x, 'name': 'r{}'.format(i), 'ok': x < 0.5} for i, x in enumerate(xs)]
+
+
+def wide_config(scale):
+    """Dict of 2000 config dicts of mixed scalars plus a small list"""
+    return {'run{}'.format(i): {'lr': 0.1 / (i + 1), 'name': 'run{}'.format(i), 'epochs': i, 'seed': None,
+                                'debug': i % 2 == 0, 'optimizer': 'adam', 'layers': [64, 128, 'relu']}
+            for i in range(scaled(2000, scale))}
+
+
+workloads = {f.__name__: f for f in [big_array, many_arrays, list_int, list_float, list_str, list_bool, deep_tree,
+                                      records, wide_config]}
+
+# Name -> (pack options, unpack options)
+configs = {
+    'default': ({}, {}),
+    'no_compression': ({'compression': False}, {}),
+    'lzf': ({'compression': 'lzf'}, {}),
+    'shuffle': ({'shuffle': True}, {}),
+    'workers': ({'workers': 4}, {'workers': 4}),
+    'contiguous_mmap': ({'contiguous': True}, {'mmap': True}),
+    'as_array': ({}, {'as_array': True}),
+    'dedup': ({'dedup': True}, {}),
+    'promote': ({'promote': True}, {}),
+    'compact': ({'compact': True}, {}),
+    'inline_scalars': ({'inline_scalars': True}, {}),
+}
+
+
+def payload_bytes(data):
+    """Rough in-memory size of data's contents: ndarray bytes, 8 bytes per number, and UTF-8 bytes of strs"""
+    data_type = type(data)
+    if data_type == np.ndarray:
+        return data.nbytes
+    elif data_type == str:
+        return len(data.encode('utf-8'))
+    elif data_type == dict:
+        return sum(map(payload_bytes, data.keys())) + sum(map(payload_bytes, data.values()))
+    elif data_type in (list, tuple, set):
+        return sum(map(payload_bytes, data))
+    elif data is None:
+        return 0
+    return 8
+
+
+def count_objects(data):
+    """Number of Python objects in data: scalars, ndarrays, and collections (not counting dict keys)"""
+    data_type = type(data)
+    if data_type == dict:
+        return 1 + sum(map(count_objects, data.values()))
+    elif data_type in (list, tuple, set):
+        return 1 + sum(map(count_objects, data))
+    return 1
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far in MB, or None if it can't be found"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3  # Bytes on macOS, KB on Linux
+
+
+def best_time(f, repeat):
+    """Shortest time of repeat calls of f()"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_pack(workload, scale, pack_opts, filename, repeat):
+    data = workloads[workload](scale)
+    pack_s = best_time(lambda: pack(data, filename, **pack_opts), repeat)
+    return {
+        'payload_mb': payload_bytes(data) / 1e6,
+        'objects': count_objects(data),
+        'size_mb': os.path.getsize(filename) / 1e6,
+        'pack_s': pack_s,
+        'pack_peak_mb': peak_rss_mb(),
+    }
+
+
+def run_unpack(filename, unpack_opts, repeat):
+    unpack_s = best_time(lambda: unpack(filename, **unpack_opts), repeat)
+    return {
+        'unpack_s': unpack_s,
+        'unpack_peak_mb': peak_rss_mb(),
+    }
+
+
+def call(isolate, f, *args):
+    """Call f(*args), in a fresh process if isolate"""
+    if not isolate:
+        return f(*args)
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(f, *args).result()
+
+
+def run_case(workload, config, scale=1.0, repeat=1, isolate=True):
+    """Pack and unpack workload at scale with the options of config. Returns a dict of results, with an 'error' str
+    instead of timings if it failed.
+    """
+    pack_opts, unpack_opts = configs[config]
+    result = {'workload': workload, 'config': config}
+    with tempfile.TemporaryDirectory() as tempdir:
+        filename = os.path.join(tempdir, 'bench.h5')
+        try:
+            result.update(call(isolate, run_pack, workload, scale, pack_opts, filename, repeat))
+            result.update(call(isolate, run_unpack, filename, unpack_opts, repeat))
+        except Exception as e:
+            result['error'] = '{}: {}'.format(type(e).__name__, e)
+            return result
+
+    for op in ['pack', 'unpack']:
+        seconds = result['{}_s'.format(op)]
+        result['{}_mb_per_s'.format(op)] = result['payload_mb'] / seconds
+        result['{}_objects_per_s'.format(op)] = result['objects'] / seconds
+    return result
+
+
+# Result key, header, width, and format spec of each column of the printed table
+columns = [
+    ('workload', 'workload', 14, ''),
+    ('config', 'config', 16, ''),
+    ('size_mb', 'size MB', 9, '.2f'),
+    ('pack_s', 'pack s', 8, '.3f'),
+    ('pack_mb_per_s', 'pack MB/s', 10, '.3g'),
+    ('pack_objects_per_s', 'pack obj/s', 11, '.3g'),
+    ('pack_peak_mb', 'pack RSS MB', 12, '.0f'),
+    ('unpack_s', 'unpack s', 9, '.3f'),
+    ('unpack_mb_per_s', 'unpack MB/s', 12, '.3g'),
+    ('unpack_objects_per_s', 'unpack obj/s', 13, '.3g'),
+    ('unpack_peak_mb', 'unpack RSS MB', 14, '.0f'),
+]
+
+
+def format_header():
+    return ' '.join(header.ljust(width) if not spec else header.rjust(width) for _, header, width, spec in columns)
+
+
+def format_row(result):
+    if 'error' in result:
+        return '{:<14} {:<16} {}'.format(result['workload'], result['config'], result['error'])
+    cells = []
+    for k, _, width, spec in columns:
+        val = result[k]
+        if val is None:  # No peak RSS
+            cells.append('-'.rjust(width))
+        elif not spec:
+            cells.append(val.ljust(width))
+        else:
+            cells.append(format(val, spec).rjust(width))
+    return ' '.join(cells)
+
+
+def parse_names(arg, choices):
+    if arg is None:
+        return list(choices)
+    names = arg.split(',')
+    for name in names:
+        if name not in choices:
+            raise SystemExit('Unknown name {!r}, choose from: {}'.format(name, ', '.join(choices)))
+    return names
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m h5pack.bench', description='Benchmark h5pack pack/unpack')
+    parser.add_argument('--workloads', help='Comma-separated workloads to run (default: all): {}'.format(
+        ', '.join(workloads)))
+    parser.add_argument('--configs', help='Comma-separated option sets to run (default: all): {}'.format(
+        ', '.join(configs)))
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiplier for the workload sizes (default: 1)')
+    parser.add_argument('--repeat', type=int, default=1, help='Number of times to time each pack and unpack, taking '
+                                                              'the fastest (default: 1)')
+    parser.add_argument('--no-isolate', dest='isolate', action='store_false',
+                        help='Run everything in this process, so peak RSS is the peak so far')
+    parser.add_argument('--json', help='File to also write the results to as JSON')
+    args = parser.parse_args(argv)
+
+    results = []
+    print(format_header(), flush=True)
+    for workload in parse_names(args.workloads, workloads):
+        for config in parse_names(args.configs, configs):
+            result = run_case(workload, config, args.scale, args.repeat, args.isolate)
+            results.append(result)
+            print(format_row(result), flush=True)
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
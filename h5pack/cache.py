@@ -0,0 +1,217 @@
+"""Caching for reading the same packs over and over, like in a server"""
+import collections
+import os
+import posixpath
+import sys
+import threading
+
+import h5py
+import numpy as np
+
+# Types of values that ValueCache copies on the way out, since they could be changed
+container_types = {dict, list, set, tuple}
+
+
+def file_key(filename):
+    """Real path of filename, plus what identifies its current contents: (path, mtime, size, inode)"""
+    path = os.path.realpath(filename)
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class HandlePool:
+    """Pool of files kept open for reading, so that reading the same files again skips opening them (parsing the
+    superblock and metadata) and keeps their HDF5 chunk caches warm. Pass it as the handles option of unpack or open.
+
+    Files are keyed by path, and are reopened if they've changed on disk since they were opened (by mtime, size, or
+    inode, so replacing a file with os.replace is picked up). The least recently used files are closed when there are
+    more than size open. Lazy proxies read from a pooled file can't be used after it's closed, and the pool can't be
+    shared between threads that read from the same files at the same time.
+
+    HDF5 can't open a file for writing in a process that has it open for reading, so call discard(filename) before
+    packing or updating a pooled file in place.
+    """
+    def __init__(self, size=16, rdcc_nbytes=None, rdcc_nslots=None, rdcc_w0=None):
+        """
+        Args:
+            size: int, max number of files to keep open
+            rdcc_nbytes: int, size in bytes of each file's raw data chunk cache (HDF5's default is 1 MiB)
+            rdcc_nslots: int, number of hash table slots of each chunk cache, ideally a prime about 100x the number of
+                chunks that fit in it
+            rdcc_w0: float, chunk cache eviction policy, from 0 (evict least recently used chunks first) to 1 (evict
+                fully read/written chunks first)
+        """
+        self.size = size
+        self.file_kwargs = {'rdcc_nbytes': rdcc_nbytes, 'rdcc_nslots': rdcc_nslots, 'rdcc_w0': rdcc_w0}
+        self.files = collections.OrderedDict()  # (path, swmr) -> (stat key, h5py.File), least recently used first
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, filename, swmr=False):
+        """Get filename open for reading, as a single-writer/multiple-reader reader if swmr"""
+        path, *stat_key = file_key(filename)
+        stat_key = tuple(stat_key)
+        key = (path, swmr)
+        with self._lock:
+            if key in self.files:
+                cached_stat_key, f = self.files[key]
+                if cached_stat_key == stat_key and f:
+                    self.files.move_to_end(key)
+                    self.hits += 1
+                    return f
+                del self.files[key]
+                f.close()
+
+            self.misses += 1
+            if swmr:
+                f = h5py.File(path, 'r', libver='latest', swmr=True, **self.file_kwargs)
+            else:
+                f = h5py.File(path, 'r', **self.file_kwargs)
+            self.files[key] = (stat_key, f)
+            while len(self.files) > self.size:
+                _, (_, old) = self.files.popitem(last=False)
+                old.close()
+            return f
+
+    def discard(self, filename):
+        """Close filename if it's open"""
+        path = os.path.realpath(filename)
+        with self._lock:
+            for key in [(path, False), (path, True)]:
+                if key in self.files:
+                    _, f = self.files.pop(key)
+                    f.close()
+
+    def clear(self):
+        """Close all files"""
+        with self._lock:
+            for _, f in self.files.values():
+                f.close()
+            self.files.clear()
+
+    def __len__(self):
+        return len(self.files)
+
+    def __repr__(self):
+        return '<HandlePool files={} hits={} misses={}>'.format(len(self.files), self.hits, self.misses)
+
+
+def freeze(data):
+    """Make the ndarrays in data read-only"""
+    data_type = type(data)
+    if issubclass(data_type, np.ndarray):
+        data.flags.writeable = False
+    elif data_type == dict:
+        for val in data.values():
+            freeze(val)
+    elif data_type in container_types:
+        for item in data:
+            freeze(item)
+
+
+def copy_containers(data):
+    """Copy the dicts, lists, sets, and tuples in data, sharing everything else"""
+    data_type = type(data)
+    if data_type == dict:
+        if container_types.isdisjoint(map(type, data.values())):
+            return dict(data)
+        return {k: copy_containers(v) for k, v in data.items()}
+    elif data_type == set:
+        return set(data)  # Items are hashable, so not containers that can be changed
+    elif data_type in (list, tuple):
+        if container_types.isdisjoint(map(type, data)):
+            return list(data) if data_type == list else data
+        return data_type(map(copy_containers, data))
+    return data
+
+
+def value_nbytes(data):
+    """Rough number of bytes of memory data takes up"""
+    data_type = type(data)
+    if issubclass(data_type, np.ndarray):
+        return data.nbytes
+    elif data_type == dict:
+        return sys.getsizeof(data) + sum(map(value_nbytes, data.keys())) + sum(map(value_nbytes, data.values()))
+    elif data_type in container_types:
+        return sys.getsizeof(data) + sum(map(value_nbytes, data))
+    return sys.getsizeof(data)
+
+
+class ValueCache:
+    """Cache of values read from packs, so that reading the same items again skips decoding them. Pass it as the cache
+    option of unpack or open; lazy proxies cache the items they read too.
+
+    Values are keyed by file, HDF5 path of the item's node, and the file's mtime, size, and inode (so they're read again
+    if the file changes), plus the options that change what's read. The least recently used values are dropped when
+    they add up to more than max_bytes. Values bigger than that aren't cached.
+
+    Cached values are shared, so ndarrays in them are made read-only (including in the value returned when it's first
+    read), and the dicts, lists, sets, and tuples in them are copied each time they're returned, so changing them
+    doesn't change the cache. Call np.array(x) to get a writeable copy of an ndarray x.
+
+    Attributes:
+        hits: int, number of reads served from the cache
+        misses: int, number of reads that weren't
+        evictions: int, number of values dropped to stay under max_bytes
+        nbytes: int, rough number of bytes of the cached values (see value_nbytes)
+    """
+    def __init__(self, max_bytes=256 * 2 ** 20):
+        """
+        Args:
+            max_bytes: int, max number of bytes of values to keep
+        """
+        self.max_bytes = max_bytes
+        self.values = collections.OrderedDict()  # key -> (value, nbytes), least recently used first
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def read(self, group, name, opts, f, *args):
+        """Get the value of the item at group[name] as read with opts, calling f(*args) to read it if it's not cached"""
+        try:
+            key = file_key(group.file.filename) + (posixpath.join(group.name, name), opts['as_array'], opts['mmap'])
+        except OSError:  # In-memory file
+            return f(*args)
+
+        with self._lock:
+            if key in self.values:
+                self.values.move_to_end(key)
+                self.hits += 1
+                return copy_containers(self.values[key][0])
+            self.misses += 1
+
+        value = f(*args)
+        freeze(value)
+        nbytes = value_nbytes(value)
+        if nbytes <= self.max_bytes:
+            with self._lock:
+                if key in self.values:  # Read by another thread meanwhile
+                    self.nbytes -= self.values[key][1]
+                self.values[key] = (value, nbytes)
+                self.nbytes += nbytes
+                while self.nbytes > self.max_bytes:
+                    _, (_, old_nbytes) = self.values.popitem(last=False)
+                    self.nbytes -= old_nbytes
+                    self.evictions += 1
+        return copy_containers(value)
+
+    def info(self):
+        """Cache statistics as a dict, like for logging or metrics"""
+        return {'entries': len(self.values), 'nbytes': self.nbytes, 'max_bytes': self.max_bytes, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+    def clear(self):
+        """Drop all values"""
+        with self._lock:
+            self.values.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def __repr__(self):
+        return '<ValueCache entries={} nbytes={} hits={} misses={}>'.format(len(self.values), self.nbytes, self.hits,
+                                                                          self.misses)
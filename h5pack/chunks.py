@@ -0,0 +1,140 @@
+"""Parallel compression and decompression of gzip dataset chunks. HDF5 runs its filter pipeline 1 chunk at a time in
+the calling thread, so instead the chunks are deflated (and shuffled) here in a thread pool - zlib releases the GIL - and
+written pre-filtered with write_direct_chunk. The result is an ordinary gzip dataset that any HDF5 reader can read.
+Reading is the reverse: raw chunks from read_direct_chunk are inflated in a thread pool into a preallocated array.
+"""
+import contextlib
+import itertools
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from h5py import h5z
+
+# Filters other than these (fletcher32, scaleoffset, lzf, ...) have to go through HDF5
+direct_filter_kwargs = {'compression', 'compression_opts', 'shuffle', 'chunks'}
+
+default_gzip_level = 4  # Same as h5py
+
+
+def thread_pool(workers):
+    """Context manager giving a ThreadPoolExecutor with workers threads, or None if workers is falsy"""
+    if workers:
+        return ThreadPoolExecutor(workers)
+    return contextlib.nullcontext()
+
+
+def is_direct_writable(data, ds_kwargs):
+    """Whether data can be written with ds_kwargs by compressing its chunks here instead of through HDF5"""
+    return ds_kwargs.get('compression') == 'gzip' and ds_kwargs.keys() <= direct_filter_kwargs and \
+        data.dtype.kind in 'biufc' and data.ndim > 0 and data.size > 0
+
+
+def chunk_slices(shape, chunks):
+    """Yield the offset and slices of each chunk of a dataset"""
+    for offset in itertools.product(*(range(0, n, c) for n, c in zip(shape, chunks))):
+        yield offset, tuple(slice(o, min(o + c, n)) for o, c, n in zip(offset, chunks, shape))
+
+
+def shuffle_bytes(block):
+    """Do what the HDF5 shuffle filter does: group the 1st bytes of all the items, then the 2nd bytes, etc."""
+    itemsize = block.dtype.itemsize
+    if itemsize == 1:
+        return block.tobytes()
+    return block.view(np.uint8).reshape(-1, itemsize).T.tobytes()
+
+
+def encode_chunk(block, chunks, level, shuffle):
+    """Filter a block of data into the bytes of a stored chunk. Edge chunks are padded out to the full chunk shape, like
+    HDF5 stores them.
+    """
+    if block.shape != chunks:
+        full = np.zeros(chunks, dtype=block.dtype)
+        full[tuple(slice(0, n) for n in block.shape)] = block
+        block = full
+    block = np.ascontiguousarray(block)
+    buf = shuffle_bytes(block) if shuffle else block.data
+    return zlib.compress(buf, level)
+
+
+def write_chunks(ds, data, executor):
+    """Compress the chunks of data in parallel and write them directly into ds, a gzip dataset created with data's shape
+    and dtype.
+    """
+    chunks = ds.chunks
+    level = ds.compression_opts
+    if level is None:
+        level = default_gzip_level
+    shuffle = ds.shuffle
+
+    offsets, blocks = zip(*((offset, data[slices]) for offset, slices in chunk_slices(data.shape, chunks)))
+    encoded = executor.map(encode_chunk, blocks, itertools.repeat(chunks), itertools.repeat(level),
+                           itertools.repeat(shuffle))
+    for offset, buf in zip(offsets, encoded):
+        ds.id.write_direct_chunk(offset, buf)
+
+
+def direct_filters(ds):
+    """The ids of ds's filters, in pipeline order, if they can all be undone here; otherwise None"""
+    if ds.chunks is None or ds.dtype.kind not in 'biufc' or ds.size == 0:
+        return None
+    plist = ds.id.get_create_plist()
+    filters = tuple(plist.get_filter(i)[0] for i in range(plist.get_nfilters()))
+    if filters not in ((h5z.FILTER_DEFLATE,), (h5z.FILTER_SHUFFLE, h5z.FILTER_DEFLATE)):
+        return None
+    return filters
+
+
+def is_direct_readable(ds):
+    """Whether ds's chunks can be read raw and decompressed here instead of through HDF5"""
+    return direct_filters(ds) is not None
+
+
+def unshuffle_bytes(buf, dtype):
+    """Undo shuffle_bytes"""
+    itemsize = dtype.itemsize
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    if itemsize == 1:
+        return raw.view(dtype)
+    return raw.reshape(itemsize, -1).T.copy().view(dtype)
+
+
+def decode_chunk(buf, filters, filter_mask, chunks, dtype):
+    """Undo the filters on the bytes of a stored chunk, skipping the ones that filter_mask says weren't applied"""
+    for i in reversed(range(len(filters))):
+        if filter_mask & (1 << i):
+            continue
+        if filters[i] == h5z.FILTER_DEFLATE:
+            buf = zlib.decompress(buf)
+        else:
+            buf = unshuffle_bytes(buf, dtype)
+    return np.frombuffer(buf, dtype=dtype).reshape(chunks)
+
+
+def decode_chunk_into(out, slices, buf, filters, filter_mask, chunks):
+    """Decode a stored chunk and copy its (possibly partial, at the edges) block into out"""
+    block = decode_chunk(buf, filters, filter_mask, chunks, out.dtype)
+    out[slices] = block[tuple(slice(0, s.stop - s.start) for s in slices)]
+
+
+def read_chunks(ds, executor):
+    """Read ds, a gzip dataset (see is_direct_readable), by reading its raw chunks and decompressing them in parallel
+    into a preallocated array. Chunks that were never written get the fill value.
+    """
+    filters = direct_filters(ds)
+    chunks = ds.chunks
+    out = np.empty(ds.shape, dtype=ds.dtype)
+
+    n_chunks = ds.id.get_num_chunks()
+    if n_chunks < np.prod([-(-n // c) for n, c in zip(ds.shape, chunks)]):
+        out[...] = ds.fillvalue
+
+    futures = []
+    for i in range(n_chunks):
+        offset = ds.id.get_chunk_info(i).chunk_offset
+        filter_mask, buf = ds.id.read_direct_chunk(offset)
+        slices = tuple(slice(o, min(o + c, n)) for o, c, n in zip(offset, chunks, ds.shape))
+        futures.append(executor.submit(decode_chunk_into, out, slices, buf, filters, filter_mask, chunks))
+    for future in futures:
+        future.result()
+    return out
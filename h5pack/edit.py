@@ -0,0 +1,204 @@
+"""Changing items of an existing pack in place, without rewriting the whole file"""
+import operator
+import os
+
+import h5py
+import numpy as np
+
+from h5pack.chunks import thread_pool
+from h5pack.h5pack import clean_key, drop_scalar, indexed_types, is_collection_str, is_vlen_str, item_index, key_name, \
+    locate, read_data, read_meta, read_opts, restore_key, str_type_map, write_data, write_dict_item, write_opts
+
+
+def is_heterogeneous_group(meta):
+    """Whether the node with metadata meta is a heterogeneous list, tuple, or dict, whose items are each their own
+    group/dataset
+    """
+    collection_type_str = meta['collection_type']
+    return is_collection_str(collection_type_str) and collection_type_str != 'set' and not bool(meta['homogeneous'])
+
+
+def normalize_ind(node, meta, key):
+    """Turn key into a nonnegative index into the heterogeneous list/tuple node"""
+    n = len(node)
+    ind = operator.index(key)
+    if ind < 0:
+        ind += n
+    if not 0 <= ind < n:
+        raise IndexError('{} index out of range at {}'.format(meta['collection_type'], node.name))
+    return ind
+
+
+def set_in(data, path, value):
+    """Return data with the item at path set to value. Tuples are copied since they can't be changed."""
+    key = path[0]
+    if len(path) > 1:
+        value = set_in(data[key], path[1:], value)
+
+    if type(data) == tuple:
+        items = list(data)
+        items[key] = value
+        return tuple(items)
+    elif type(data) == set:
+        raise TypeError('Can\'t index into set')
+    data[key] = value
+    return data
+
+
+def delete_in(data, path):
+    """Return data with the item at path deleted. Tuples are copied since they can't be changed."""
+    key = path[0]
+    if len(path) > 1:
+        return set_in(data, path[:1], delete_in(data[key], path[1:]))
+
+    if type(data) == tuple:
+        items = list(data)
+        del items[key]
+        return tuple(items)
+    elif type(data) == set:
+        raise TypeError('Can\'t index into set')
+    del data[key]
+    return data
+
+
+def rewrite(group, name, change, opts):
+    """Read the item at group[name], change it with change(data) -> data, and write it back in its place. This
+    redoes the choice of encoding, so e.g. a homogeneous dict becomes heterogeneous if needed.
+    """
+    meta = read_meta(group[name])
+    key_type = str_type_map[meta['key_type']] if 'key_type' in meta else None
+    data = change(read_data(group, name, read_opts(), meta))
+    del group[name]
+    write_data(group, name, data, opts, key_type=key_type)
+
+
+def update_item(group, name, key, value):
+    """Try to overwrite 1 item of the homogeneous list, tuple, or dict at group[name] in place. Only works if the
+    item is there and value has the same type as the other items (and fits, for fixed-width strs). Returns whether it
+    worked.
+    """
+    node = group[name]
+    meta = read_meta(node)
+    if not is_collection_str(meta['collection_type']) or not bool(meta['homogeneous']) or \
+            meta['collection_type'] == 'set':
+        return False
+    try:
+        ds, ind, ds_meta = item_index(group, name, key)
+    except (KeyError, IndexError, TypeError):
+        return False
+    if isinstance(node, h5py.Group) and 'tags' in node:  # Promoted dict, whose tags would need changing too
+        return False
+    if h5py.h5o.get_info(ds.id).rc > 1:  # Hard linked by dedup, so changing it would change the other links too
+        return False
+
+    data_type = str_type_map[ds_meta['data_type']]
+    if type(value) != data_type:
+        return False
+    elif data_type == str and not is_vlen_str(ds.dtype):
+        if not value.isascii():
+            return False
+        value = np.string_(value)
+        if len(value) > ds.dtype.itemsize:
+            return False
+    elif data_type == bool:
+        value = np.int8(value)
+    ds[ind] = value
+    return True
+
+
+def update(filename, path, value, **options):
+    """Set the item at path in the pack in filename to value, only rewriting the group or dataset that holds it.
+
+    Items of heterogeneous lists, tuples, and dicts are their own groups/datasets, so just they are replaced. Items of
+    homogeneous lists, tuples, and dicts are overwritten in place if value has the same type as the rest (and fits, for
+    strs). Otherwise, like for items in records and ragged lists, the whole collection is read, changed, and rewritten,
+    which also switches its encoding if needed (like when adding a key of another type to a homogeneous dict). Dict
+    keys that aren't there are added. Scalars inlined into a heterogeneous dict's metadata (see pack's inline_scalars
+    option) are just removed from it, and value is inlined if inline_scalars is passed.
+
+    The space used by replaced items isn't freed; see repack.
+
+    Args:
+        filename: str, name of file to change
+        path: sequence of keys/indexes to the item, like for unpack. Empty to replace everything.
+        value: New value of the item
+        options: Same options as pack, for writing value
+    """
+    opts = write_opts(**options)
+    with h5py.File(filename, 'r+') as f, thread_pool(opts['workers']) as executor:
+        opts['executor'] = executor
+
+        if len(path) == 0:
+            del f['root']
+            write_data(f, 'root', value, opts)
+            return
+
+        group, name, rest = locate(f, 'root', path[:-1])
+        key = path[-1]
+        node = group[name]
+        meta = read_meta(node)
+        if not rest and is_heterogeneous_group(meta):
+            if str_type_map[meta['collection_type']] in indexed_types:
+                k = '{}'.format(normalize_ind(node, meta, key))
+                del node[k]
+                write_data(node, k, value, opts)
+            else:
+                k = clean_key(key)
+                if k in node and restore_key(k, read_meta(node[k])['key_type']) != key:
+                    raise KeyError('Key {!r} would have the same name as an existing key'.format(key))
+                write_dict_item(node, key, value, opts)
+        elif not rest and update_item(group, name, key, value):
+            pass
+        else:
+            rewrite(group, name, lambda data: set_in(data, rest + (key,), value), opts)
+
+
+def delete(filename, path, **options):
+    """Delete the item at path from the pack in filename, only rewriting the group or dataset that holds it. Like for
+    update, items of heterogeneous lists, tuples, and dicts are just deleted (later items of lists/tuples are renamed to
+    close the gap), while for other collections the whole collection is rewritten.
+
+    The space used by deleted items isn't freed; see repack.
+
+    Args:
+        filename: str, name of file to change
+        path: sequence of keys/indexes to the item, like for unpack
+        options: Same options as pack, for rewriting the collection holding the item
+    """
+    if len(path) == 0:
+        raise ValueError('Can\'t delete the root')
+
+    opts = write_opts(**options)
+    with h5py.File(filename, 'r+') as f, thread_pool(opts['workers']) as executor:
+        opts['executor'] = executor
+
+        group, name, rest = locate(f, 'root', path[:-1])
+        key = path[-1]
+        node = group[name]
+        meta = read_meta(node)
+        if not rest and is_heterogeneous_group(meta):
+            if str_type_map[meta['collection_type']] in indexed_types:
+                n = len(node)
+                ind = normalize_ind(node, meta, key)
+                del node['{}'.format(ind)]
+                for i in range(ind + 1, n):
+                    node.move('{}'.format(i), '{}'.format(i - 1))
+            elif not drop_scalar(node, key):
+                del node[key_name(node, key)]
+        else:
+            rewrite(group, name, lambda data: delete_in(data, rest + (key,)), opts)
+
+
+def repack(filename, out_filename=None):
+    """Copy the pack in filename into a fresh file, which frees the space left unused by update and delete (HDF5 files
+    don't shrink). Datasets keep their layout and filters.
+
+    Args:
+        filename: str, name of file to repack
+        out_filename: str, name of file to write, or None to replace filename
+    """
+    tmp_filename = filename + '.repack' if out_filename is None else out_filename
+    with h5py.File(filename, 'r') as src, h5py.File(tmp_filename, 'w') as dst:
+        src.copy(src['root'], dst, 'root')
+    if out_filename is None:
+        os.replace(tmp_filename, filename)
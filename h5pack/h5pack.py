@@ -1,6 +1,18 @@
+import bisect
+import contextlib
+import hashlib
+import itertools
+import json
+import operator
+import os
+import posixpath
+from collections.abc import Mapping, Sequence
+
 import h5py
 import numpy as np
 
+from h5pack.chunks import is_direct_readable, is_direct_writable, read_chunks, thread_pool, write_chunks
+
 numeric_types = {int, float}
 primitive_types = {int, float, str, bool, type(None), np.ndarray}  # Numpy array behaves like a primitive for most purposes
 collection_types = {tuple, list, dict, set}
@@ -9,6 +21,29 @@ associative_types = {dict, set}
 
 collection_type_strs = {x.__name__ for x in collection_types}
 
+# Item types that make a collection heterogeneous, since they can't be items of a homogeneous collection's dataset
+heterogeneous_types = collection_types | {np.ndarray, type(None)}
+
+# Item types that can be mixed in 1 promoted dataset, and the biggest int that's exact as a float
+promotable_types = {bool, int, float}
+max_exact_float_int = 2 ** 53
+
+memory_file_ids = itertools.count()
+
+meta_attr = 'h5pack'  # Name of the single JSON attr holding a node's metadata, for pack(compact=True)
+
+# Heterogeneous dict items that can be inlined into the dict's metadata with pack(inline_scalars=True), since JSON keeps
+# their types, and the most bytes of JSON to inline per dict (HDF5 attrs in the object header are limited to 64 KiB)
+inline_key_types = {int, str}
+inline_val_types = {int, float, str, bool, type(None)}
+max_inline_bytes = 32 * 1024
+
+# Strs are stored variable-length if padding them all to the longest would take more than this many times their total
+# length, plus some bytes
+max_str_padding = 2
+min_str_padding_bytes = 1024
+str_dtype = h5py.string_dtype('utf-8')
+
 
 # For converting data_type metadata
 str_type_map = {
@@ -66,63 +101,19 @@ def is_collection_str(x_str):
     return False
 
 
-def is_indexed_homogeneous(data):
-    """Returns True for homogeneous, False for heterogeneous.
-    TODO: Special case of ints and floats mixed -> homogeneous float
-    An empty indexed collection is homogeneous.
-    An indexed collection with any None (including only made of Nones) is heterogeneous.
-    ndarray behaves like collection for this purpose.
-    """
-    if len(data) == 0:
-        return True
-
-    type0 = type(data[0])
-    if type0 == type(None):
-        return False
-    for item in data:
-        item_type = type(item)
-        if item_type != type0 or item_type in collection_types or item_type == np.ndarray:
-            return False
-    return True
-
-
 def is_dict_homogeneous(data):
     """Returns True for homogeneous, False for heterogeneous.
     An empty dict is homogeneous.
+    A dict with any None val is heterogeneous.
     ndarray behaves like collection for this purpose.
     """
     if len(data) == 0:
         return True
 
-    k0, v0 = next(iter(data.items()))
-    ktype0 = type(k0)
-    vtype0 = type(v0)
-    if ktype0 in collection_types or ktype0 == np.ndarray or vtype0 in collection_types or vtype0 == np.ndarray:
-        return False
-    for k, v in data.items():
-        ktype = type(k)
-        vtype = type(v)
-        if (ktype != ktype0 or ktype in collection_types or ktype == np.ndarray) or \
-                (vtype != vtype0 or vtype in collection_types or vtype == np.ndarray):
-            return False
-    return True
-
-
-def is_set_homogeneous(data):
-    """Returns True for homogeneous, False for heterogeneous.
-    An empty set is homogeneous.
-    """
-    if len(data) == 0:
-        return True
-
-    k0 = next(iter(data))
-    ktype0 = type(k0)
-    if ktype0 in collection_types:
-        return False
-    for k in data:
-        if type(k) != ktype0:
-            return False
-    return True
+    key_types = set(map(type, data.keys()))
+    val_types = set(map(type, data.values()))
+    return len(key_types) == 1 and len(val_types) == 1 and key_types.isdisjoint(collection_types) and \
+        np.ndarray not in key_types and val_types.isdisjoint(heterogeneous_types)
 
 
 def validate_inds(keys):
@@ -144,45 +135,426 @@ def clean_key(key):
     return str(key)
 
 
-def write_attrs(ds, attrs):
-    """Write dataset attributes dict, including special handling of 'type' attr."""
+def restore_key(key, key_type_str):
+    """Turn a group name back into the original key of a heterogeneous dict, using its key_type attr"""
+    ktype = str_type_map[key_type_str]
+    if ktype != str:  # Try to turn non-str key back into original type - should just be ints
+        key = ktype(key)
+    return key
+
+
+def key_name(group, key):
+    """Get the name of the item for key in group, a heterogeneous dict. Raise KeyError if it's not there."""
+    k = clean_key(key)
+    if k not in group or restore_key(k, read_meta(group[k])['key_type']) != key:
+        raise KeyError(key)
+    return k
+
+
+def is_inline_scalar(key, val):
+    """Whether key: val can be inlined into a heterogeneous dict's metadata. Ints have to fit in an int64 like they do
+    in a dataset.
+    """
+    val_type = type(val)
+    return type(key) in inline_key_types and val_type in inline_val_types and \
+        (val_type != int or -2 ** 63 <= val < 2 ** 63)
+
+
+def split_scalars(data):
+    """Split the items of heterogeneous dict data into the scalars to inline into its metadata (see is_inline_scalar),
+    up to about max_inline_bytes of JSON, and the rest. Returns 2 lists of (key, val) pairs.
+    """
+    scalars = []
+    rest = []
+    size = 0
+    for k, v in data.items():
+        if is_inline_scalar(k, v):
+            size += 32 + (len(json.dumps(k)) if type(k) == str else 0) + (len(json.dumps(v)) if type(v) == str else 0)
+            if size <= max_inline_bytes:
+                scalars.append((k, v))
+                continue
+        rest.append((k, v))
+    return scalars, rest
+
+
+def read_scalars(meta):
+    """Get the scalars inlined into a heterogeneous dict's metadata as a dict. Empty if there aren't any."""
+    scalars = meta.get('scalars')
+    if scalars is None:
+        return {}
+    elif isinstance(scalars, str):  # Separate attr, rather than part of the compact JSON attr
+        scalars = json.loads(scalars)
+    return {k: v for k, v in scalars}
+
+
+def in_scalars(scalars, key):
+    """Whether key is one of the inlined scalars, from read_scalars. Checks the type so 1.0 or True don't match 1."""
+    return type(key) in inline_key_types and key in scalars
+
+
+def write_scalars(sub_group, meta, scalars):
+    """Replace the scalars inlined into the heterogeneous dict at sub_group, with metadata meta, by the dict scalars,
+    keeping the layout (compact or not) it was written with
+    """
+    write_attrs(sub_group, dict(meta, scalars=list(scalars.items())), meta_attr in sub_group.attrs)
+
+
+def drop_scalar(sub_group, key):
+    """Remove key from the scalars inlined into the heterogeneous dict at sub_group, if it's there. Returns whether it
+    was.
+    """
+    meta = read_meta(sub_group)
+    scalars = read_scalars(meta)
+    if not in_scalars(scalars, key):
+        return False
+    del scalars[key]
+    write_scalars(sub_group, meta, scalars)
+    return True
+
+
+def write_dict_item(sub_group, key, val, opts):
+    """Write key: val into the heterogeneous dict at sub_group, replacing what's there. It's inlined into the dict's
+    metadata if opts['inline_scalars'] and it fits, like write_associative does.
+    """
+    k = clean_key(key)
+    if k in sub_group:
+        del sub_group[k]
+    drop_scalar(sub_group, key)
+
+    if opts['inline_scalars'] and is_inline_scalar(key, val):
+        meta = read_meta(sub_group)
+        scalars = read_scalars(meta)
+        scalars[key] = val
+        if len(json.dumps(list(scalars.items()))) <= max_inline_bytes:
+            write_scalars(sub_group, meta, scalars)
+            return sub_group
+    write_data(sub_group, k, val, opts, key_type=type(key))
+    return sub_group
+
+
+def get_record_columns(data):
+    """If the dicts in data (a list/tuple of dicts, or records) all have the same keys, and the vals for each key are
+    homogeneous, return a dict of key -> (item type, encoded array) for the column of vals. Otherwise return None.
+    """
+    keys = data[0].keys()
+    if len(keys) == 0:
+        return None
+    for item in data:
+        if item.keys() != keys:
+            return None
+
+    columns = {}
+    for k in keys:
+        encoding, encoded = encode_indexed(list(map(operator.itemgetter(k), data)), nested=False)
+        if encoding != 'homogeneous':
+            return None
+        columns[k] = encoded
+    return columns
+
+
+def get_ragged_values(data, item_type):
+    """If data, a list/tuple of item_type items, is of 1-D numeric ndarrays with the same dtype, or of homogeneous
+    numeric lists/tuples with the same item type, return the concatenated values, the offsets of each item into them,
+    and item_type. Otherwise return None.
+    """
+    if item_type == np.ndarray:
+        dtype = data[0].dtype
+        for item in data:
+            if item.ndim != 1 or item.dtype != dtype:
+                return None
+        if not (np.issubdtype(dtype, np.number) or dtype == bool):
+            return None
+        values = np.concatenate(data)
+        value_type = np.ndarray
+    elif item_type in indexed_types:
+        value_types = set(map(type, itertools.chain.from_iterable(data)))
+        if len(value_types) != 1:
+            return None
+        value_type = value_types.pop()
+        if not is_number_type(value_type):
+            return None
+        values = np.array(list(itertools.chain.from_iterable(data)))
+        if value_type == int and values.dtype.kind != 'i':
+            return None  # Ints too big for int64, which come out as objects, uint64, or float64 and can't be read back
+    else:
+        return None
+
+    offsets = np.zeros(len(data) + 1, dtype=np.int64)
+    np.cumsum([len(item) for item in data], out=offsets[1:])
+    return values, offsets, item_type, value_type
+
+
+def encode_strs(vals):
+    """Convert a list/tuple of strs into the array that's stored for them: fixed-width ASCII bytes, or variable-length
+    UTF-8 if any aren't ASCII or their lengths vary so much that padding them to the longest would blow up the size
+    """
+    joined = ''.join(vals)
+    if joined.isascii():
+        padded = len(vals) * max(map(len, vals), default=0)
+        if padded <= max_str_padding * len(joined) + min_str_padding_bytes:
+            return np.string_(vals)
+    return np.array(vals, dtype=str_dtype)
+
+
+def is_vlen_str(dtype):
+    """Whether dtype is of a variable-length str dataset"""
+    info = h5py.check_string_dtype(dtype)
+    return info is not None and info.length is None
+
+
+def read_vals(ds, sel=Ellipsis):
+    """Read the items of dataset ds at sel (all of them by default). Variable-length strs are decoded by h5py, coming
+    out as strs.
+    """
+    if is_vlen_str(ds.dtype):
+        return ds.asstr()[sel]
+    return ds[sel]
+
+
+def encode_vals(vals, item_type):
+    """Convert a homogeneous list/tuple of item_type items into the array that's stored for them"""
+    if item_type == str:
+        return encode_strs(vals)
+    elif item_type == bool:
+        return np.int8(vals)
+    return np.asarray(vals)
+
+
+def promote_vals(data, item_types):
+    """If data (list/tuple items or dict vals, of item_types) mixes ints, floats, and bools, and/or has Nones mixed
+    with items of 1 other type, return an array that holds them all exactly, the type it holds, an int8 array of tags
+    saying which of item_types each item is, and item_types in tag order. Otherwise return None.
+    """
+    value_types = item_types - {type(None)}
+    if value_types <= promotable_types:
+        if float in value_types:
+            value_type = float
+            # Also keeps the ints within int64, which they're read back as
+            if int in value_types and any(abs(x) > max_exact_float_int for x in data if type(x) == int):
+                return None
+        elif int in value_types:
+            value_type = int
+        else:
+            value_type = bool  # Also for only Nones
+    elif len(value_types) == 1 and value_types.isdisjoint(heterogeneous_types):
+        value_type = next(iter(value_types))
+    else:
+        return None
+
+    item_types = sorted(item_types, key=operator.attrgetter('__name__'))
+    tag_map = {item_type: tag for tag, item_type in enumerate(item_types)}
+    tags = np.fromiter(map(tag_map.__getitem__, map(type, data)), dtype=np.int8, count=len(data))
+
+    if type(None) in tag_map:
+        fill = value_type()
+        data = [fill if x is None else x for x in data]
+    vals = encode_vals(data, value_type)
+    if vals.dtype == object or (value_type == int and vals.dtype.kind != 'i'):
+        return None  # Ints too big for int64, which come out as objects, uint64, or float64 and can't be read back
+    return vals, value_type, tags, item_types
+
+
+def encode_indexed(data, nested=True, promote=False):
+    """Decide how to store list/tuple data from 1 pass over its item types, and build what's written for it. Returns
+    (encoding, encoded), one of:
+        ('homogeneous', (item_type, vals)): vals is the array to store, or None if data is empty
+        ('records', columns): see get_record_columns
+        ('ragged', (values, offsets, item_type, value_type)): see get_ragged_values
+        ('promoted', (vals, value_type, tags, item_types)): see promote_vals
+        ('heterogeneous', None)
+    Records and ragged are only tried if nested, since set items and record columns can't be stored those ways.
+    Promoted is only tried if promote.
+    """
+    item_types = set(map(type, data))
+    if len(item_types) == 0:
+        return 'homogeneous', (type(None), None)
+    elif len(item_types) == 1:
+        item_type = next(iter(item_types))
+        if item_type not in heterogeneous_types:
+            return 'homogeneous', (item_type, encode_vals(data, item_type))
+        elif nested and item_type == dict:
+            columns = get_record_columns(data)
+            if columns is not None:
+                return 'records', columns
+        elif nested and (item_type == np.ndarray or item_type in indexed_types):
+            ragged = get_ragged_values(data, item_type)
+            if ragged is not None:
+                return 'ragged', ragged
+    if promote:
+        promoted = promote_vals(data, item_types)
+        if promoted is not None:
+            return 'promoted', promoted
+    return 'heterogeneous', None
+
+
+def dedup_key(data_type, item_type, vals):
+    """Key identifying the content of vals, the array that's stored for data of data_type (with items of item_type,
+    for a homogeneous list/tuple), and how it's stored. None if it can't be hashed.
+    """
+    if vals.dtype.kind not in 'biufcS':
+        return None
+    digest = hashlib.blake2b(np.ascontiguousarray(vals).data, digest_size=16).digest()
+    return data_type, item_type, vals.dtype.str, vals.shape, digest
+
+
+def link_duplicate(group, name, targets, key_type, compact):
+    """Hard link group[name] to the first of targets, already written datasets with the same dedup_key, whose key_type
+    attr doesn't conflict with key_type (the links share attrs), setting it if needed. Returns the linked dataset, or
+    None if none fit.
+    """
+    for target in targets:
+        target_meta = read_meta(target)
+        target_key_type = target_meta.get('key_type')
+        if key_type is None or target_key_type is None or target_key_type == key_type.__name__:
+            group[name] = target
+            if key_type is not None and target_key_type is None:
+                write_attrs(target, dict(target_meta, key_type=key_type), compact)
+            return group[name]
+    return None
+
+
+def write_attrs(ds, attrs, compact=False):
+    """Write dataset attributes dict, including special handling of 'type' attr. None vals (like the key_type of an
+    item that's not in a dict) are skipped. If compact, they're all written as 1 JSON attr instead of 1 attr each, so
+    attrs has to have all of them. Otherwise inlined scalars are written as their own JSON attr.
+    """
+    meta = {}
     for k, v in attrs.items():
-        if k == 'data_type' or k == 'collection_type' or k == 'key_type':
+        if v is None:
+            continue
+        if k == 'data_type' or k == 'collection_type' or k == 'key_type' or k == 'item_type':
             try:  # For Python types
                 v = v.__name__
             except AttributeError:  # For Numpy types
                 v = str(v)
-        ds.attrs[k] = v
+        elif k == 'scalars' and not compact:
+            v = json.dumps(v)
+        meta[k] = v
+
+    if compact:
+        ds.attrs[meta_attr] = json.dumps(meta)
+    else:
+        for k, v in meta.items():
+            ds.attrs[k] = v
+
+
+def read_meta(node):
+    """Read all of a group or dataset's metadata into a dict at once, from the JSON attr of packs made with
+    compact=True, or else from the separate attrs
+    """
+    meta = dict(node.attrs)
+    if meta_attr in meta:
+        return json.loads(meta[meta_attr])
+    return meta
 
 
-def write_primitive(group, name, data, ds_kwargs):
+def write_dedup_flag(node):
+    """Record in the root node's metadata that pack(dedup=True) may have hard linked datasets under it, so that unpack
+    knows to read each linked dataset once
+    """
+    if meta_attr in node.attrs:
+        write_attrs(node, dict(read_meta(node), dedup=True), compact=True)
+    else:
+        write_attrs(node, {'dedup': True})
+
+
+def timer(opts, phase):
+    """Context manager timing phase with opts['stats'], if set"""
+    stats = opts['stats']
+    if stats is None:
+        return contextlib.nullcontext()
+    return stats.timer(phase)
+
+
+def filter_kwargs(ds_kwargs, dtype, payload=True):
+    """ds_kwargs without the scale-offset filter, unless the dataset holds ints or floats of the data itself. HDF5 only
+    supports the filter for those, and it's lossy, so it's not for the offsets, tags, and keys that index the data.
+    """
+    if 'scaleoffset' in ds_kwargs and (not payload or np.dtype(dtype).kind not in 'iuf'):
+        return {k: v for k, v in ds_kwargs.items() if k != 'scaleoffset'}
+    return ds_kwargs
+
+
+def create_dataset(group, name, data, opts, payload=True):
+    """Create a non-scalar dataset with the chunking and filter options in opts. Data smaller than opts['min_size']
+    bytes is stored contiguous with no filters, since the chunking overhead would be bigger than the data. The
+    scale-offset filter only applies to int and float payload data (see filter_kwargs). Then opts['policy'], if set, is
+    called with the dataset's path and data and may return a dict of create_dataset kwargs that override these.
+    If opts['executor'] is set, gzip datasets have their chunks compressed in parallel by it.
+    """
+    with timer(opts, 'datasets'):
+        data = np.asarray(data)
+        ds_kwargs = filter_kwargs(opts['ds_kwargs'], data.dtype, payload)
+        if data.nbytes < opts['min_size'] or data.size == 0 or data.ndim == 0:
+            ds_kwargs = {}
+
+        policy = opts['policy']
+        if policy is not None:
+            overrides = policy(posixpath.join(group.name, name), data)
+            if overrides:
+                ds_kwargs = dict(ds_kwargs, **overrides)
+
+        executor = opts['executor']
+        if executor is not None and is_direct_writable(data, ds_kwargs):
+            ds = group.create_dataset(name, shape=data.shape, dtype=data.dtype, **ds_kwargs)
+            write_chunks(ds, data, executor)
+            return ds
+
+        return group.create_dataset(name, data=data, **ds_kwargs)
+
+
+def write_primitive(group, name, data, opts, key_type=None):
     """Note: No dataset chunk options (like compression) for scalar"""
     data_type = type(data)
 
     # Write dataset
-    if data_type == np.ndarray:
-        ds = group.create_dataset(name, data=data, **ds_kwargs)  # enable compression for nonscalar numpy array
-    elif data_type == str:
-        ds = group.create_dataset(name, data=np.string_(data))
-    elif data_type == bool:
-        ds = group.create_dataset(name, data=int(data))
-    elif data_type == type(None):
-        ds = group.create_dataset(name, data=0)
-    else:
-        ds = group.create_dataset(name, data=data)
+    with timer(opts, 'datasets'):
+        if data_type == np.ndarray and opts['contiguous']:
+            ds = group.create_dataset(name, data=data)  # No chunks or filters, so it can be memory-mapped
+        elif data_type == np.ndarray:
+            ds = create_dataset(group, name, data, opts)  # enable compression for nonscalar numpy array
+        elif data_type == str and data.isascii():
+            ds = group.create_dataset(name, data=np.string_(data))
+        elif data_type == str:
+            ds = group.create_dataset(name, data=data, dtype=str_dtype)
+        elif data_type == bool:
+            ds = group.create_dataset(name, data=int(data))
+        elif data_type == type(None):
+            ds = group.create_dataset(name, data=0)
+        else:
+            ds = group.create_dataset(name, data=data)
 
     # Write attrs
-    write_attrs(ds, {'data_type': data_type, 'collection_type': 'primitive'})
+    write_attrs(ds, {'data_type': data_type, 'collection_type': 'primitive', 'key_type': key_type}, opts['compact'])
     return ds
 
 
-def read_primitive(group, name):
+def memmap_dataset(ds):
+    """Memory-map ds read-only straight from the file, if it's stored contiguous and unfiltered in a file on disk.
+    Otherwise return None.
+    """
+    offset = ds.id.get_offset()  # From the start of the file, userblock included. None if chunked or not allocated.
+    if offset is None or ds.external or ds.file.driver != 'sec2' or ds.dtype.kind not in 'biufc' or ds.size == 0:
+        return None
+    return np.memmap(ds.file.filename, dtype=ds.dtype, mode='r', offset=offset, shape=ds.shape)
+
+
+def read_primitive(group, name, opts, meta):
     """"""
     ds = group[name]
-    data_type = str_type_map[ds.attrs['data_type']]
-    val = ds[...]
+    data_type = str_type_map[meta['data_type']]
+    if data_type == np.ndarray and opts['mmap']:
+        val = memmap_dataset(ds)
+        if val is not None:
+            return val
+
+    executor = opts['executor']
+    if executor is not None and data_type == np.ndarray and is_direct_readable(ds):
+        val = read_chunks(ds, executor)
+    else:
+        val = read_vals(ds)
     if data_type == str:
-        val = str(np.char.decode(val, 'utf-8'))
+        val = decode_val(val[()], str)
     elif data_type == bool:
         val = bool(val)
     elif data_type == type(None):
@@ -196,63 +568,66 @@ def read_primitive(group, name):
     return val
 
 
-def write_indexed(group, name, data, ds_kwargs):
-    """Write list or tuple"""
+def write_indexed(group, name, data, opts, key_type=None, encoded=None):
+    """Write list or tuple. encoded is encode_indexed(data), if that's already been done."""
     data_type = type(data)
+    if encoded is None:
+        with timer(opts, 'encode'):
+            encoded = encode_indexed(data, promote=opts['promote'])
+    encoding, encoded = encoded
+
+    if encoding == 'homogeneous':  # Save homogeneous as numpy array
+        return write_homogeneous(group, name, data_type, *encoded, opts, key_type)
+    elif encoding == 'records':
+        return write_records(group, name, data_type, encoded, opts, key_type)
+    elif encoding == 'ragged':
+        return write_ragged(group, name, data_type, *encoded, opts, key_type)
+    elif encoding == 'promoted':
+        return write_promoted(group, name, data_type, *encoded, opts, key_type)
+    return write_heterogeneous(group, name, data_type, data, opts, key_type)
+
+
+def write_homogeneous(group, name, data_type, item_type, vals, opts, key_type=None):
+    """Write homogeneous list, tuple, or set, from the array of vals made by encode_indexed"""
+    if vals is None:  # Empty
+        ds = group.create_dataset(name, data=0)
+    else:
+        ds = create_dataset(group, name, vals, opts)
+    write_attrs(ds, {'data_type': item_type, 'collection_type': data_type, 'homogeneous': True, 'key_type': key_type},
+                opts['compact'])
+    return ds
 
-    homegeneous = is_indexed_homogeneous(data)
 
-    if len(data) == 0:
-        type0 = type(None)
-    else:
-        type0 = type(data[0])
-
-    if homegeneous:  # Save homogeneous as numpy array
-        item_type = type0
-        if item_type == str:
-            ds = group.create_dataset(name, data=np.string_(data), **ds_kwargs)
-        elif item_type == bool:
-            ds = group.create_dataset(name, data=np.int8(data), **ds_kwargs)
-        elif item_type == type(None):
-            ds = group.create_dataset(name, data=0)
-        else:
-            ds = group.create_dataset(name, data=data, **ds_kwargs)
-        write_attrs(ds, {'data_type': item_type, 'collection_type': data_type, 'homogeneous': True})
-        return ds
-    else:  # Save heterogeneous as a subgroup with indexed vals
-        sub_group = group.create_group(name)
-        for i, item in enumerate(data):
-            write_data(sub_group, '{}'.format(i), item, ds_kwargs)
-        write_attrs(sub_group, {'data_type': data_type, 'collection_type': data_type, 'homogeneous': False})
-        return sub_group
+def write_heterogeneous(group, name, data_type, data, opts, key_type=None):
+    """Write heterogeneous list, tuple, or set (data as a list) as a subgroup with indexed vals"""
+    sub_group = group.create_group(name)
+    for i, item in enumerate(data):
+        write_data(sub_group, '{}'.format(i), item, opts)
+    write_attrs(sub_group, {'data_type': data_type, 'collection_type': data_type, 'homogeneous': False,
+                            'key_type': key_type}, opts['compact'])
+    return sub_group
 
 
-def read_indexed(group, name):
+def read_indexed(group, name, opts, meta):
     """Read list or tuple"""
     sub_group = group[name]  # A dataset for homogeneous; a group for heterogeneous
-    collection_type = str_type_map[sub_group.attrs['collection_type']]
-    homogeneous = bool(sub_group.attrs['homogeneous'])
+    collection_type = str_type_map[meta['collection_type']]
+    homogeneous = bool(meta['homogeneous'])
 
     # Read homogeneous array as single val
     if homogeneous:
-        ds = group[name]
-        item_type = str_type_map[ds.attrs['data_type']]
-        vals = ds[...]
-        if item_type == str:
-            vals = list(val.decode('utf-8') for val in vals)
-        elif item_type == bool:
-            vals = list(bool(val) for val in vals)
-        elif item_type == type(None):
-            vals = []
-        else:
-            vals = list(item_type(val) for val in vals)
+        ds = sub_group
+        item_type = str_type_map[meta['data_type']]
+        vals = decode_vals(read_vals(ds), item_type, as_array=opts['as_array'])
+        if opts['as_array']:
+            return vals
     else:
         keys = sub_group.keys()
         validate_inds(keys)
         vals = [None] * len(keys)
         for ind_str in sub_group.keys():
             ind = int(ind_str)
-            vals[ind] = read_data(sub_group, ind_str)
+            vals[ind] = read_data(sub_group, ind_str, opts)
 
     # Convert list to tuple if needed
     if collection_type == tuple:
@@ -261,148 +636,323 @@ def read_indexed(group, name):
     return vals
 
 
-def write_associative(group, name, data, ds_kwargs):
+def write_records(group, name, data_type, columns, opts, key_type=None):
+    """Write list or tuple of records (see get_record_columns) as a subgroup holding 1 homogeneous list dataset per key,
+    instead of 1 subgroup per record. Column datasets are named and tagged with key_type like a heterogeneous dict.
+    """
+    sub_group = group.create_group(name, track_order=True)  # Keep the records' key order
+    for k, (item_type, vals) in columns.items():
+        write_homogeneous(sub_group, clean_key(k), list, item_type, vals, opts, type(k))
+    write_attrs(sub_group, {'data_type': data_type, 'collection_type': 'records', 'key_type': key_type},
+                opts['compact'])
+    return sub_group
+
+
+def read_records(group, name, opts, meta):
+    """Read list or tuple of records, rebuilding them from the columns"""
+    sub_group = group[name]
+    collection_type = str_type_map[meta['data_type']]
+    column_opts = dict(opts, as_array=False)
+
+    keys = []
+    columns = []
+    for k, ds in sub_group.items():
+        column_meta = read_meta(ds)
+        keys.append(restore_key(k, column_meta['key_type']))
+        columns.append(read_indexed(sub_group, k, column_opts, column_meta))
+    vals = [dict(zip(keys, row)) for row in zip(*columns)]
+
+    if collection_type == tuple:
+        vals = tuple(vals)
+    return vals
+
+
+def write_ragged(group, name, data_type, values, offsets, item_type, value_type, opts, key_type=None):
+    """Write list or tuple of variable-length numeric vectors (see get_ragged_values) as a subgroup holding 1 dataset of
+    all the concatenated values and 1 of the offsets where each item starts (plus the end), instead of 1 dataset per
+    item.
+    """
+    sub_group = group.create_group(name)
+    ds_values = create_dataset(sub_group, 'values', values, opts)
+    create_dataset(sub_group, 'offsets', offsets, opts, payload=False)
+    write_attrs(ds_values, {'data_type': value_type}, opts['compact'])
+    write_attrs(sub_group, {'data_type': data_type, 'collection_type': 'ragged', 'item_type': item_type,
+                            'key_type': key_type}, opts['compact'])
+    return sub_group
+
+
+def read_ragged(group, name, meta):
+    """Read list or tuple of variable-length numeric vectors. ndarray items are views into the single values array."""
+    sub_group = group[name]
+    collection_type = str_type_map[meta['data_type']]
+    item_type = str_type_map[meta['item_type']]
+    ds_values = sub_group['values']
+    values = ds_values[...]
+    offsets = sub_group['offsets'][...]
+
+    if item_type == np.ndarray:
+        vals = np.split(values, offsets[1:-1])
+    else:
+        values = decode_vals(values, str_type_map[read_meta(ds_values)['data_type']])
+        offsets = offsets.tolist()
+        vals = [item_type(values[start:end]) for start, end in zip(offsets[:-1], offsets[1:])]
+
+    if collection_type == tuple:
+        vals = tuple(vals)
+    return vals
+
+
+def write_promoted(group, name, data_type, vals, value_type, tags, item_types, opts, key_type=None):
+    """Write list or tuple of mixed numbers and/or Nones (see promote_vals) as a subgroup holding 1 dataset of the
+    promoted vals and 1 of the tags saying what type each item was, instead of 1 dataset per item.
+    """
+    sub_group = group.create_group(name)
+    write_promoted_vals(sub_group, vals, value_type, tags, item_types, opts)
+    write_attrs(sub_group, {'data_type': data_type, 'collection_type': 'promoted', 'key_type': key_type},
+                opts['compact'])
+    return sub_group
+
+
+def write_promoted_vals(sub_group, vals, value_type, tags, item_types, opts):
+    """Write the vals and tags datasets of a promoted list, tuple, or dict. The tags index into the item_types attr."""
+    ds_vals = create_dataset(sub_group, 'vals', vals, opts)
+    ds_tags = create_dataset(sub_group, 'tags', tags, opts, payload=False)
+    write_attrs(ds_vals, {'data_type': value_type}, opts['compact'])
+    write_attrs(ds_tags, {'item_types': [item_type.__name__ for item_type in item_types]}, opts['compact'])
+
+
+def read_promoted(group, name, meta):
+    """Read list or tuple of mixed numbers and/or Nones"""
+    sub_group = group[name]
+    vals = read_promoted_vals(sub_group)
+    if str_type_map[meta['data_type']] == tuple:
+        vals = tuple(vals)
+    return vals
+
+
+def read_promoted_vals(sub_group):
+    """Read the vals of a promoted list, tuple, or dict back into items of the types in their tags"""
+    ds_vals = sub_group['vals']
+    ds_tags = sub_group['tags']
+    vals = read_vals(ds_vals)
+    tags = ds_tags[...]
+
+    items = np.empty(len(tags), dtype=object)  # Starts out all None
+    for tag, item_type_str in enumerate(read_meta(ds_tags)['item_types']):
+        item_type = str_type_map[item_type_str]
+        if item_type == type(None):
+            continue
+        mask = tags == tag
+        item_vals = vals[mask]
+        if item_type == int:
+            item_vals = item_vals.astype(np.int64)
+        items[mask] = decode_vals(item_vals, item_type)
+    return items.tolist()
+
+
+def promote_dict(data):
+    """If the keys of dict data are homogeneous and its vals can be promoted (see promote_vals), return the sorted keys
+    and the promoted vals. Otherwise return None.
+    """
+    key_types = set(map(type, data.keys()))
+    if len(key_types) != 1 or not key_types.isdisjoint(collection_types) or np.ndarray in key_types:
+        return None
+    keys, vals = zip(*sorted(data.items()))
+    promoted = promote_vals(vals, set(map(type, vals)))
+    if promoted is None:
+        return None
+    return list(keys), promoted
+
+
+def write_associative(group, name, data, opts, key_type=None):
     """Dicts (homogeneous and heterogeneous) are stored in a subgroup; Sets are stored like lists/tuples.
     Note: If heterogeneous, keys are packed as strings but restored to previous val on unpack.
     """
     data_type = type(data)
 
     if data_type == dict:
-        # See if it's homogeneous - the keys are all 1 type and he vals are all 1 type
-        homogeneous = is_dict_homogeneous(data)
+        with timer(opts, 'encode'):
+            # See if it's homogeneous - the keys are all 1 type and he vals are all 1 type
+            homogeneous = is_dict_homogeneous(data)
+            promoted = None
+            if not homogeneous and opts['promote']:  # Or the vals can be promoted to 1 type
+                promoted = promote_dict(data)
+                homogeneous = promoted is not None
+
+            # Scalar vals of heterogeneous dicts can go in its metadata instead of sub-items
+            scalars = None
+            items = data.items()
+            if not homogeneous and opts['inline_scalars']:
+                scalars, items = split_scalars(data)
 
         # Create subgroup that holds key/val datasets for homogeneous, or keys sub-items for heterogeneous
         sub_group = group.create_group(name)
-        write_attrs(sub_group, {'data_type': data_type, 'collection_type': data_type, 'homogeneous': homogeneous})
+        write_attrs(sub_group, {'data_type': data_type, 'collection_type': data_type, 'homogeneous': homogeneous,
+                                'key_type': key_type, 'scalars': scalars or None}, opts['compact'])
 
         # Save homogeneous dict as 2 arrays
         if homogeneous:
             if len(data) == 0:  # Handle special case of empty dict
                 ds_keys = sub_group.create_dataset('keys', data=0)
                 ds_vals = sub_group.create_dataset('vals', data=0)
-                write_attrs(ds_keys, {'data_type': type(None)})
-                write_attrs(ds_vals, {'data_type': type(None)})
+                write_attrs(ds_keys, {'data_type': type(None)}, opts['compact'])
+                write_attrs(ds_vals, {'data_type': type(None)}, opts['compact'])
                 return sub_group
 
-            keys = []
-            vals = []
-            for k, v in sorted(data.items()):  # guaranteed to be orderable
-                keys.append(k)
-                vals.append(v)
-            ktype = type(k)
-            vtype = type(v)
+            if promoted is not None:
+                keys, promoted_vals = promoted
+                ktype = type(keys[0])
+            else:
+                keys = []
+                vals = []
+                for k, v in sorted(data.items()):  # guaranteed to be orderable
+                    keys.append(k)
+                    vals.append(v)
+                ktype = type(k)
+                vtype = type(v)
+                if vtype == str:
+                    vals = encode_strs(vals)
             if ktype == str:
-                keys = np.string_(keys)
-            if vtype == str:
-                vals = np.string_(vals)
-
-            ds_keys = sub_group.create_dataset('keys', data=keys, **ds_kwargs)
-            ds_vals = sub_group.create_dataset('vals', data=vals, **ds_kwargs)
-            write_attrs(ds_keys, {'data_type': ktype})
-            write_attrs(ds_vals, {'data_type': vtype})
+                keys = encode_strs(keys)
+
+            ds_keys = create_dataset(sub_group, 'keys', keys, opts, payload=False)
+            write_attrs(ds_keys, {'data_type': ktype}, opts['compact'])
+            if promoted is not None:
+                write_promoted_vals(sub_group, *promoted_vals, opts)
+            else:
+                ds_vals = create_dataset(sub_group, 'vals', vals, opts)
+                write_attrs(ds_vals, {'data_type': vtype}, opts['compact'])
         else:
-            for k, v in data.items():
+            for k, v in items:
                 ktype = type(k)
                 k = clean_key(k)  # Turn key into string
-                write_data(sub_group, k, v, ds_kwargs, key_type=ktype)  # add extra info for key type for unpacking
+                write_data(sub_group, k, v, opts, key_type=ktype)  # add extra info for key type for unpacking
 
         return sub_group
 
     elif data_type == set:
-        # Write like an indexed collection
+        # Write like a homogeneous or heterogeneous indexed collection
         data_list = list(data)
-        group_ = write_indexed(group, name, data_list, ds_kwargs)
-
-        # Overwrite attrs
-        homogeneous = is_set_homogeneous(data)
-        if homogeneous:
-            if len(data) == 0:  # Handle special case of empty set
-                item_type = type(None)
-            else:
-                item_type = type(data_list[0])
-        else:
-            item_type = data_type
-        write_attrs(group_, {'data_type': item_type, 'collection_type': data_type, 'homogeneous': homogeneous})
-        return group_
+        with timer(opts, 'encode'):
+            encoding, encoded = encode_indexed(data_list, nested=False)
+        if encoding == 'homogeneous':
+            return write_homogeneous(group, name, data_type, *encoded, opts, key_type)
+        return write_heterogeneous(group, name, data_type, data_list, opts, key_type)
 
     else:
         raise Exception('should not reach here')
 
 
-def read_associative(group, name):
+def read_associative(group, name, opts, meta):
     """"""
     sub_group = group[name]
-    collection_type = str_type_map[sub_group.attrs['collection_type']]
-    homogeneous = bool(sub_group.attrs['homogeneous'])
+    collection_type = str_type_map[meta['collection_type']]
+    homogeneous = bool(meta['homogeneous'])
 
     if collection_type == dict:
         if homogeneous:
             ds_keys = sub_group['keys']
-            ktype = str_type_map[ds_keys.attrs['data_type']]
-            keys = ds_keys[...]
+            ktype = str_type_map[read_meta(ds_keys)['data_type']]
             if ktype == type(None):  # Handle special case of empty dict
                 return {}
-            elif ktype == str:
-                keys = list(key.decode('utf-8') for key in keys)
-            else:
-                keys = list(ktype(key) for key in keys)
+            keys = decode_vals(read_vals(ds_keys), ktype)
 
-            ds_vals = sub_group['vals']
-            vtype = str_type_map[ds_vals.attrs['data_type']]
-            vals = ds_vals[...]
-            if vtype == str:
-                vals = list(val.decode('utf-8') for val in vals)
+            if 'tags' in sub_group:  # Promoted
+                vals = read_promoted_vals(sub_group)
             else:
-                vals = list(vtype(val) for val in vals)
+                ds_vals = sub_group['vals']
+                vtype = str_type_map[read_meta(ds_vals)['data_type']]
+                vals = decode_vals(read_vals(ds_vals), vtype)
 
-            return {k: v for k, v in zip(keys, vals)}
+            return dict(zip(keys, vals))
         else:
             d = {}
             for key, key_group in sub_group.items():
-                val = read_data(sub_group, key)
-                ktype = str_type_map[key_group.attrs['key_type']]
-                if ktype != str:  # Try to turn non-str key back into original type - should just be ints
-                    key = ktype(key)
-                d[key] = val
+                key_meta = read_meta(key_group)
+                val = read_data(sub_group, key, opts, key_meta)
+                d[restore_key(key, key_meta['key_type'])] = val
+            d.update(read_scalars(meta))
             return d
 
     elif collection_type == set:
         # Read like an indexed collection
-        d = read_indexed(group, name)
+        d = read_indexed(group, name, dict(opts, as_array=False), meta)
         return set(d)
 
     else:
         raise ValueError('Associative type not recognized')
 
 
-def write_collection(group, name, data, ds_kwargs):
+def read_collection(group, name, opts, meta):
     """"""
-    data_type = type(data)
+    collection_type = str_type_map[meta['collection_type']]
 
-    # Check whether collection is indexed or associative
-    if data_type in indexed_types:
-        group_ = write_indexed(group, name, data, ds_kwargs)
-    elif data_type in associative_types:
-        group_ = write_associative(group, name, data, ds_kwargs)
+    if collection_type in indexed_types:
+        return read_indexed(group, name, opts, meta)
+    elif collection_type in associative_types:
+        return read_associative(group, name, opts, meta)
     else:
-        raise Exception('should not reach here')
+        raise Exception('Collection type not recognized')
 
-    return group_
 
+# Function that writes each type. Numpy number types are added as they're seen.
+write_handlers = {
+    int: write_primitive,
+    float: write_primitive,
+    str: write_primitive,
+    bool: write_primitive,
+    type(None): write_primitive,
+    np.ndarray: write_primitive,
+    tuple: write_indexed,
+    list: write_indexed,
+    dict: write_associative,
+    set: write_associative,
+}
 
-def read_collection(group, name):
-    """"""
-    collection_type = str_type_map[group[name].attrs['collection_type']]
 
-    if collection_type in indexed_types:
-        return read_indexed(group, name)
-    elif collection_type in associative_types:
-        return read_associative(group, name)
+def write_handler(data_type):
+    """Get the function that writes data of data_type from write_handlers"""
+    try:
+        return write_handlers[data_type]
+    except KeyError:
+        if is_number_type(data_type):
+            write_handlers[data_type] = write_primitive
+            return write_primitive
+        raise ValueError('Data not one of the valid primitive or collection types')
+
+
+def write_dedup(group, name, data, opts, key_type):
+    """Write data like write_node, except that ndarrays and homogeneous lists/tuples identical to ones already written
+    (found by dedup_key in opts['links']) are hard linked to them instead
+    """
+    data_type = type(data)
+    encoded = None
+    content_key = None
+    if data_type == np.ndarray:
+        content_key = dedup_key(data_type, None, data)
+    elif data_type in indexed_types:
+        with timer(opts, 'encode'):
+            encoded = encode_indexed(data, promote=opts['promote'])
+        encoding, homogeneous = encoded
+        if encoding == 'homogeneous' and homogeneous[1] is not None:  # Empty ones aren't worth it
+            content_key = dedup_key(data_type, *homogeneous)
+
+    links = opts['links']
+    if content_key is not None:
+        group_ = link_duplicate(group, name, links.get(content_key, ()), key_type, opts['compact'])
+        if group_ is not None:
+            return group_
+
+    if encoded is not None:
+        group_ = write_indexed(group, name, data, opts, key_type, encoded)
     else:
-        raise Exception('Collection type not recognized')
+        group_ = write_handler(data_type)(group, name, data, opts, key_type)
+    if content_key is not None:
+        links.setdefault(content_key, []).append(group_)
+    return group_
 
 
-def write_data(group, name, data, ds_kwargs, key_type=None):
+def write_data(group, name, data, opts, key_type=None):
     """Main data writing function, which is called recursively. Does the heavy lifting of determining the type and
     writing the data accordingly.
 
@@ -410,60 +960,678 @@ def write_data(group, name, data, ds_kwargs, key_type=None):
         group: Previous group this will be attached to
         name: Name of current group or dataset to hold this data
         data: Data to store
-        ds_kwargs: Options
+        opts: dict of options, from write_opts
         key_type: type for data arg when data is a key in a dict/set
     """
-    data_type = type(data)
+    stats = opts['stats']
+    if stats is not None:
+        return stats.record('pack', group, name, write_node, group, name, data, opts, key_type)
+    return write_node(group, name, data, opts, key_type)
 
-    # Check whether type is primitive or collection
-    if is_primitive_type(data_type):
-        group_ = write_primitive(group, name, data, ds_kwargs)
-    elif is_collection_type(data_type):
-        group_ = write_collection(group, name, data, ds_kwargs)
-    else:
-        raise ValueError('Data not one of the valid primitive or collection types')
 
-    if key_type is not None:
-        write_attrs(group_, {'key_type': key_type})
+def write_node(group, name, data, opts, key_type=None):
+    """Write data into group[name] with the writer for its type. See write_data."""
+    if opts['links'] is not None:
+        return write_dedup(group, name, data, opts, key_type)
+    return write_handler(type(data))(group, name, data, opts, key_type)
 
-    return group_
 
+def read_data(group, name, opts, meta=None):
+    """Main data reading function, which is called recursively.
 
-def read_data(group, name):
-    """"""
-    collection_type_str = group[name].attrs['collection_type']
-    data_type = str_type_map[group[name].attrs['data_type']]
+    Args:
+        group: Group holding the data
+        name: Name of group or dataset holding the data
+        opts: dict of options, from read_opts
+        meta: dict of the node's metadata, from read_meta, if it's already been read
+    """
+    cache = opts['cache']
+    if cache is not None:
+        # The items under this node are part of its cached value, so they don't need caching themselves
+        return cache.read(group, name, opts, read_data, group, name, dict(opts, cache=None), meta)
+    stats = opts['stats']
+    if stats is not None:
+        return stats.record('unpack', group, name, read_node, group, name, opts, meta)
+    return read_node(group, name, opts, meta)
+
+
+def read_node(group, name, opts, meta=None):
+    """Read the data at group[name] with the reader for how it's stored. See read_data."""
+    node = group[name]
+    if opts['swmr'] and isinstance(node, h5py.Dataset):
+        node.refresh()  # Pick up items appended since the file was opened
+    if meta is None:
+        meta = read_meta(node)
+
+    # Read datasets hard linked by dedup once, returning the same object for each link
+    memo = opts['memo']
+    if memo is not None and isinstance(node, h5py.Dataset):
+        info = h5py.h5o.get_info(node.id)
+        if info.rc > 1:
+            key = (node.id.fileno, info.addr)  # Addresses are per file, and sharded packs span several
+            if key not in memo:
+                memo[key] = read_node(group, name, dict(opts, memo=None), meta)
+            return memo[key]
+
+    collection_type_str = meta['collection_type']
+    data_type = str_type_map[meta['data_type']]
 
     if is_collection_str(collection_type_str):
-        return read_collection(group, name)
+        return read_collection(group, name, opts, meta)
+    elif collection_type_str == 'records':
+        return read_records(group, name, opts, meta)
+    elif collection_type_str == 'ragged':
+        return read_ragged(group, name, meta)
+    elif collection_type_str == 'promoted':
+        return read_promoted(group, name, meta)
     elif is_primitive_type(data_type):
-        return read_primitive(group, name)
+        return read_primitive(group, name, opts, meta)
     else:
         raise ValueError('Data type not recognized')
 
 
-def pack(data, filename, compression=True):
+def locate(group, name, path):
+    """Follow a path of keys/indexes from group[name] down through heterogeneous collections, mapping each onto the
+    group names that write_data made for them.
+
+    Returns:
+        group, name: Parent group and name of the deepest node that's its own group or dataset
+        rest: The remaining part of path. Either empty, a single key/index into the homogeneous list, tuple, or dict
+            dataset at group[name], a single index into the ragged or promoted subgroup at group[name], an index and
+            optionally a key into the records subgroup at group[name], or a single key of a scalar inlined into the
+            heterogeneous dict subgroup at group[name]
+    """
+    for i, key in enumerate(path):
+        item = group[name]
+        meta = read_meta(item)
+        collection_type_str = meta['collection_type']
+        if collection_type_str == 'records':
+            if len(path) - i > 2:
+                raise TypeError('Can\'t index into a field of a record at {}'.format(item.name))
+            return group, name, path[i:]
+        elif collection_type_str == 'ragged' or collection_type_str == 'promoted':
+            if len(path) - i > 1:
+                raise TypeError('Can\'t index into an item of {} {} at {}'.format(collection_type_str,
+                                                                                 meta['data_type'], item.name))
+            return group, name, path[i:]
+        elif not is_collection_str(collection_type_str):
+            raise TypeError('Can\'t index into {} at {}'.format(meta['data_type'], item.name))
+
+        collection_type = str_type_map[collection_type_str]
+        homogeneous = bool(meta['homogeneous'])
+        if collection_type == set:
+            raise TypeError('Can\'t index into set at {}'.format(item.name))
+        elif homogeneous:
+            if i != len(path) - 1:
+                raise TypeError('Can\'t index into an item of homogeneous {} at {}'.format(collection_type_str,
+                                                                                         item.name))
+            return group, name, path[i:]
+        elif collection_type in indexed_types:
+            ind = operator.index(key)
+            if ind < 0:
+                ind += len(item)
+            if not 0 <= ind < len(item):
+                raise IndexError('{} index out of range at {}'.format(collection_type_str, item.name))
+            group, name = item, str(ind)
+        else:
+            scalars = read_scalars(meta)
+            if in_scalars(scalars, key):
+                if i != len(path) - 1:
+                    raise TypeError('Can\'t index into {} at {}'.format(type(scalars[key]).__name__,
+                                                                        posixpath.join(item.name, clean_key(key))))
+                return group, name, path[i:]
+            group, name = item, key_name(item, key)
+
+    return group, name, ()
+
+
+def decode_val(val, data_type):
+    """Convert a single item read from a homogeneous collection dataset back into data_type"""
+    if data_type == str:
+        return val if isinstance(val, str) else val.decode('utf-8')
+    elif data_type == bool:
+        return bool(val)
+    return data_type(val)
+
+
+def decode_vals(vals, data_type, as_array=False):
+    """Convert a homogeneous collection dataset's array back into a list of data_type items, or an array of them if
+    as_array. Vectorized: Python built-in types come out of ndarray.tolist() directly.
+    """
+    if data_type == type(None):  # Empty collection is stored as a scalar
+        return np.empty(0) if as_array else []
+    elif data_type == str and vals.dtype == object:  # Variable-length, already decoded by read_vals
+        vals = vals.astype(str) if as_array else vals
+    elif data_type == str:
+        codes = vals.view(np.uint8)
+        if codes.size == 0 or codes.max() < 0x80:  # Pure ASCII, so each byte is just widened into a code point
+            vals = codes.astype(np.uint32).view('U{}'.format(vals.dtype.itemsize))
+        else:
+            vals = [val.decode('utf-8') for val in vals.tolist()]
+            return np.array(vals) if as_array else vals
+    elif data_type == bool:
+        vals = vals.astype(bool)
+    elif data_type not in numeric_types:
+        vals = vals.astype(data_type, copy=False)  # Numpy number type
+
+    if as_array:
+        return vals
+    elif data_type == int and vals.dtype.kind not in 'iu':  # Ints beyond int64 and uint64 are stored as float64
+        return [int(val) for val in vals.tolist()]
+    elif data_type in numeric_types or data_type == str or data_type == bool:
+        return vals.tolist()
+    return list(vals)  # Keep Numpy scalars
+
+
+def item_index(group, name, key):
+    """Find where a single item of the homogeneous list, tuple, or dict at group[name] is stored. Dict keys are found by
+    binary search, since write_associative sorts them.
+
+    Also works for promoted lists, tuples, and dicts, whose tags dataset has the same index.
+
+    Returns:
+        ds: Dataset holding the item: the list/tuple itself, or the dict's (or promoted list/tuple's) vals
+        ind: int, index of the item in ds
+        meta: dict, ds's metadata
+    """
+    item = group[name]
+    meta = read_meta(item)
+    collection_type_str = meta['collection_type']
+
+    if collection_type_str == 'promoted':
+        ds = item['vals']
+        collection_type_str = meta['data_type']
+        meta = read_meta(ds)
+    elif str_type_map[collection_type_str] in indexed_types:
+        ds = item
+    else:
+        ds = None
+
+    if ds is not None:
+        n = 0 if meta['data_type'] == 'NoneType' else len(ds)  # Empty list/tuple is stored as a scalar
+        ind = operator.index(key)
+        if ind < 0:
+            ind += n
+        if not 0 <= ind < n:
+            raise IndexError('{} index out of range at {}'.format(collection_type_str, item.name))
+        return ds, ind, meta
+
+    ds_keys = item['keys']
+    ktype = str_type_map[read_meta(ds_keys)['data_type']]
+    if ktype == type(None) or (ktype == str) != isinstance(key, str):  # Empty dict or incomparable key
+        raise KeyError(key)
+    target = key.encode('utf-8') if ktype == str else key
+    ind = bisect.bisect_left(ds_keys, target)
+    if ind == len(ds_keys) or ds_keys[ind] != target:
+        raise KeyError(key)
+    ds = item['vals']
+    return ds, ind, read_meta(ds)
+
+
+def read_item(group, name, key):
+    """Read a single item out of a homogeneous list, tuple, or dict at group[name]. Reads just that element of the
+    dataset.
+    """
+    ds, ind, meta = item_index(group, name, key)
+    item_type = str_type_map[meta['data_type']]
+    item = group[name]
+    if isinstance(item, h5py.Group) and 'tags' in item:  # Promoted
+        ds_tags = item['tags']
+        item_type = str_type_map[read_meta(ds_tags)['item_types'][ds_tags[ind]]]
+        if item_type == type(None):
+            return None
+    return decode_val(ds[ind], item_type)
+
+
+def read_record(group, name, ind, *keys):
+    """Read a single record, or the val for a key of it, out of a records subgroup. Reads just that element of the
+    column datasets.
+    """
+    sub_group = group[name]
+    if keys:
+        return read_item(sub_group, key_name(sub_group, keys[0]), ind)
+    return {restore_key(k, read_meta(ds)['key_type']): read_item(sub_group, k, ind) for k, ds in sub_group.items()}
+
+
+def read_ragged_item(group, name, ind):
+    """Read a single item out of a ragged subgroup. Reads just its slice of the values dataset."""
+    sub_group = group[name]
+    meta = read_meta(sub_group)
+    ds_offsets = sub_group['offsets']
+    n = len(ds_offsets) - 1
+    ind = operator.index(ind)
+    if ind < 0:
+        ind += n
+    if not 0 <= ind < n:
+        raise IndexError('{} index out of range at {}'.format(meta['data_type'], sub_group.name))
+    start, end = ds_offsets[ind:ind + 2]
+
+    ds_values = sub_group['values']
+    val = ds_values[start:end]
+    item_type = str_type_map[meta['item_type']]
+    if item_type != np.ndarray:
+        val = item_type(decode_vals(val, str_type_map[read_meta(ds_values)['data_type']]))
+    return val
+
+
+def read_path(group, name, path, opts, lazy=False):
+    """Read just the item at path under group[name]. See locate.
+    If lazy, return proxies like read_lazy does.
+    """
+    group, name, rest = locate(group, name, path)
+    if rest:
+        node = group[name]
+        if opts['swmr'] and isinstance(node, h5py.Dataset):
+            node.refresh()
+        meta = read_meta(node)
+        collection_type_str = meta['collection_type']
+        if collection_type_str == 'records':
+            return read_record(group, name, *rest)
+        elif collection_type_str == 'ragged':
+            return read_ragged_item(group, name, rest[0])
+        elif collection_type_str == 'dict' and not bool(meta['homogeneous']):
+            return read_scalars(meta)[rest[0]]
+        return read_item(group, name, rest[0])
+    elif lazy:
+        return read_lazy(group, name, opts)
+    return read_data(group, name, opts)
+
+
+class LazyArray:
+    """Sliceable handle to an ndarray leaf. Indexing reads only the requested hyperslab from the file; converting with
+    np.asarray or calling read() loads the whole array.
+    """
+    def __init__(self, ds):
+        self.ds = ds
+
+    @property
+    def shape(self):
+        return self.ds.shape
+
+    @property
+    def dtype(self):
+        return self.ds.dtype
+
+    @property
+    def ndim(self):
+        return self.ds.ndim
+
+    @property
+    def size(self):
+        return self.ds.size
+
+    def __len__(self):
+        return len(self.ds)
+
+    def __getitem__(self, key):
+        return self.ds[key]
+
+    def __array__(self, dtype=None):
+        val = self.ds[...]
+        if dtype is not None:
+            val = val.astype(dtype, copy=False)
+        return val
+
+    def read(self):
+        return self.ds[...]
+
+    def __repr__(self):
+        return '<LazyArray {} shape={} dtype={}>'.format(self.ds.name, self.shape, self.dtype)
+
+
+class LazyList(Sequence):
+    """Proxy for a homogeneous list or tuple in a file that's being written (see unpack's swmr option). Indexing reads
+    just the requested items; call refresh() to pick up items appended since it was made or last refreshed.
+
+    Usage:
+        n = len(losses)
+        losses.refresh()
+        new_losses = losses[n:]
+    """
+    def __init__(self, ds, meta):
+        self.ds = ds
+        self.item_type = str_type_map[meta['data_type']]
+        self.collection_type = str_type_map[meta['collection_type']]
+
+    def refresh(self):
+        """Update to the items that are in the file now. Returns the new length."""
+        self.ds.refresh()
+        return len(self)
+
+    def __len__(self):
+        if self.item_type == type(None):  # Empty list/tuple is stored as a scalar
+            return 0
+        return len(self.ds)
+
+    def __getitem__(self, ind):
+        n = len(self)
+        if isinstance(ind, slice):
+            start, stop, step = ind.indices(n)
+            if step < 0 or start >= stop:
+                return self.collection_type(self[i] for i in range(start, stop, step))
+            vals = read_vals(self.ds, slice(start, stop, step))
+            return self.collection_type(decode_vals(vals, self.item_type))
+        ind = operator.index(ind)
+        if ind < 0:
+            ind += n
+        if not 0 <= ind < n:
+            raise IndexError('{} index out of range'.format(self.collection_type.__name__))
+        return decode_val(read_vals(self.ds, ind), self.item_type)
+
+    def read(self):
+        """Read the whole list or tuple into memory"""
+        return self[:]
+
+    def __repr__(self):
+        return '<LazyList {} {} len={}>'.format(self.ds.name, self.collection_type.__name__, len(self))
+
+
+class LazyIndexed(Sequence):
+    """Proxy for a heterogeneous list or tuple. Items are read from the file when indexed."""
+    def __init__(self, group, name, opts):
+        self.group = group
+        self.name = name
+        self.opts = opts
+        self.sub_group = group[name]
+        self.collection_type = str_type_map[read_meta(self.sub_group)['collection_type']]
+        self._len = len(self.sub_group)
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, ind):
+        if isinstance(ind, slice):
+            return self.collection_type(self[i] for i in range(*ind.indices(self._len)))
+        ind = operator.index(ind)
+        if ind < 0:
+            ind += self._len
+        if not 0 <= ind < self._len:
+            raise IndexError('{} index out of range'.format(self.collection_type.__name__))
+        return read_lazy(self.sub_group, str(ind), self.opts)
+
+    def read(self):
+        """Read the whole list or tuple into memory"""
+        return read_data(self.group, self.name, self.opts)
+
+    def __repr__(self):
+        return '<LazyIndexed {} {} len={}>'.format(self.sub_group.name, self.collection_type.__name__, self._len)
+
+
+class LazyDict(Mapping):
+    """Proxy for a heterogeneous dict. Vals are read from the file when looked up by key, except for inlined scalars,
+    which are read up front with the dict's metadata.
+    """
+    def __init__(self, group, name, opts):
+        self.group = group
+        self.name = name
+        self.opts = opts
+        self.sub_group = group[name]
+        self.scalars = read_scalars(read_meta(self.sub_group))
+
+    def __getitem__(self, key):
+        if in_scalars(self.scalars, key):
+            return self.scalars[key]
+        return read_lazy(self.sub_group, key_name(self.sub_group, key), self.opts)
+
+    def __iter__(self):
+        for k, key_group in self.sub_group.items():
+            yield restore_key(k, read_meta(key_group)['key_type'])
+        yield from self.scalars
+
+    def __len__(self):
+        return len(self.sub_group) + len(self.scalars)
+
+    def read(self):
+        """Read the whole dict into memory"""
+        return read_data(self.group, self.name, self.opts)
+
+    def __repr__(self):
+        return '<LazyDict {} len={}>'.format(self.sub_group.name, len(self))
+
+
+def read_lazy(group, name, opts):
+    """Like read_data, but heterogeneous lists, tuples, and dicts come back as proxies that read items on demand and
+    ndarrays come back as LazyArray handles. Homogeneous collections and sets are single datasets (or small groups)
+    and are read eagerly, except that homogeneous lists and tuples come back as LazyLists if opts['swmr'], since they
+    may be growing.
+    """
+    item = group[name]
+    meta = read_meta(item)
+    collection_type_str = meta['collection_type']
+
+    if collection_type_str == 'primitive':
+        if meta['data_type'] == 'ndarray':
+            if opts['mmap']:
+                val = memmap_dataset(item)
+                if val is not None:
+                    return val
+            return LazyArray(item)
+        return read_primitive(group, name, opts, meta)
+    elif is_collection_str(collection_type_str) and not bool(meta['homogeneous']):
+        collection_type = str_type_map[collection_type_str]
+        if collection_type in indexed_types:
+            return LazyIndexed(group, name, opts)
+        elif collection_type == dict:
+            return LazyDict(group, name, opts)
+    elif opts['swmr'] and str_type_map.get(collection_type_str) in indexed_types:
+        item.refresh()
+        return LazyList(item, meta)
+    return read_data(group, name, opts, meta)
+
+
+def write_opts(compression=True, compression_opts=None, shuffle=False, fletcher32=False, scaleoffset=None,
+               chunks=None, min_size=1024, policy=None, workers=None, contiguous=False, dedup=False,
+               promote=False, compact=False, inline_scalars=False, stats=None):
+    """Build the options dict that's passed down through write_data from pack's keyword args. See pack."""
+    ds_kwargs = {}
+    if compression is True:
+        compression = 'gzip'
+    if compression:
+        ds_kwargs['compression'] = compression
+        if compression_opts is not None:
+            ds_kwargs['compression_opts'] = compression_opts
+    if shuffle:
+        ds_kwargs['shuffle'] = True
+    if fletcher32:
+        ds_kwargs['fletcher32'] = True
+    if scaleoffset is not None:
+        ds_kwargs['scaleoffset'] = scaleoffset
+    if chunks is not None:
+        ds_kwargs['chunks'] = chunks
+
+    return {
+        'ds_kwargs': ds_kwargs,
+        'min_size': min_size,
+        'policy': policy,
+        'workers': workers,
+        'executor': None,  # Set while packing if workers
+        'contiguous': contiguous,
+        'links': {} if dedup else None,  # dedup_key -> datasets written with it
+        'promote': promote,
+        'compact': compact,
+        'inline_scalars': inline_scalars,
+        'stats': stats,
+    }
+
+
+def pack(data, filename, compression=True, *, shard_size=None, **options):
     """Pack data into filename.
 
     Args:
         data: str, number (int or float), ndarray, or tuple, list, dict, set of them to save
-        filename: str, name of file to save
-        compression: bool, whether to gzip each dataset
+        filename: str, name of file to save, or a file-like object opened for binary writing
+        compression: bool or str, whether to compress each (non-scalar) dataset, or the filter to compress with: 'gzip'
+            (same as True), 'lzf', or 'szip'
+        compression_opts: compression filter setting, like the gzip level (0-9)
+        shuffle: bool, whether to apply the byte shuffle filter before compression, which helps a lot for numbers
+        fletcher32: bool, whether to add a checksum to each chunk
+        scaleoffset: int, lossy scale-offset filter setting (see h5py), or None to not use it. Only applied to int and
+            float data, not strs or the offsets, tags, and keys that index the data.
+        chunks: True to auto-compute chunk shapes, a tuple chunk shape, or None to chunk only when a filter needs it
+        min_size: int, datasets smaller than this many bytes are stored contiguous with no filters
+        policy: callable(path, data) -> dict or None, called for each dataset with its HDF5 path (like '/root/a/b')
+            and data as an ndarray, which can return h5py create_dataset kwargs (like compression, shuffle, chunks) to
+            override the ones above. Use this for per-dtype or per-path settings.
+        workers: int, number of threads to compress gzip datasets' chunks with in parallel. Only datasets with no filters
+            besides gzip and shuffle are compressed this way; the rest go through HDF5 as usual.
+        contiguous: bool, whether to store ndarrays contiguous with no chunking or filters (overriding the options
+            above for them), so they can be memory-mapped with unpack(..., mmap=True)
+        dedup: bool, whether to store identical ndarrays and homogeneous lists/tuples once, as hard links to the first
+            copy. Unpacking returns the same object for each link.
+        promote: bool, whether to store lists, tuples, and dict vals that mix ints, floats, and bools, or that have
+            Nones mixed with items of 1 other type, as 1 dataset of the widest type plus 1 of type tags (so the items
+            come back as the same types), instead of 1 dataset per item. Ints are only promoted to float if they're
+            exact as floats (abs <= 2**53).
+        compact: bool, whether to write each group/dataset's metadata (its type, etc.) as 1 JSON attr named 'h5pack'
+            instead of 1 attr per field, which is a lot faster to write and read for packs with many small items
+        inline_scalars: bool, whether to store the int, float, str, bool, and None vals under int or str keys of
+            heterogeneous dicts (like config dicts) together as JSON in the dict's metadata, instead of 1 dataset each.
+            Up to about 32 KiB of them per dict are inlined; the rest, and ndarrays and collections, are stored as
+            usual.
+        stats: h5pack.stats.Stats to record each node's time, size, and encoding in, and the time spent in each phase
+            of packing
+        shard_size: int, number of bytes of data to put in each file, to split the pack across a master file filename
+            and shard files next to it (see h5pack.shard.pack_sharded, which can also write them in parallel), or None
+            to write 1 file
     """
-    # Setup dataset keyword args
-    ds_kwargs = {}
-    if compression:
-        ds_kwargs['compression'] = 'gzip'
+    if shard_size is not None:
+        from h5pack.shard import pack_sharded  # It builds on this module
+        pack_sharded(data, filename, shard_size, compression=compression, **options)
+        return
+
+    opts = write_opts(compression=compression, **options)
 
     # Open data file
     with h5py.File(filename, 'w') as f:
+        pack_file(f, data, opts)
+
+
+def packb(data, compression=True, **options):
+    """Pack data into bytes, an HDF5 file image that's built in memory without touching the disk. Takes the same
+    options as pack.
+    """
+    opts = write_opts(compression=compression, **options)
+    with h5py.File(memory_name(), 'w', driver='core', backing_store=False) as f:
+        pack_file(f, data, opts)
+        f.flush()
+        return f.id.get_file_image()
+
+
+def pack_file(f, data, opts):
+    """Write data into the open file f"""
+    with thread_pool(opts['workers']) as executor:
+        opts['executor'] = executor
+
         # Recursively write out data
-        write_data(f, 'root', data, ds_kwargs)
+        write_data(f, 'root', data, opts)
+        if opts['links'] is not None:
+            write_dedup_flag(f['root'])
+
+
+def memory_name():
+    """Get a unique name for an in-memory file, since HDF5 still tracks those by name"""
+    return 'h5pack-memory-{}'.format(next(memory_file_ids))
+
+
+def open_image(buf):
+    """Open an HDF5 file image (bytes-like) read-only in memory with the core driver, without copying it to disk"""
+    fapl = h5py.h5p.create(h5py.h5p.FILE_ACCESS)
+    fapl.set_fapl_core(backing_store=False)
+    fapl.set_file_image(buf)
+    return h5py.File(h5py.h5f.open(memory_name().encode(), h5py.h5f.ACC_RDONLY, fapl=fapl))
+
+
+def read_opts(as_array=False, workers=None, mmap=False, stats=None, swmr=False, handles=None, cache=None):
+    """Build the options dict that's passed down through read_data from unpack's keyword args. See unpack."""
+    return {
+        'as_array': as_array,
+        'workers': workers,
+        'executor': None,  # Set while unpacking if workers
+        'mmap': mmap,
+        'memo': None,  # Set while unpacking packs made with dedup, for datasets that are hard linked
+        'stats': stats,
+        'swmr': swmr,
+        'handles': handles,
+        'cache': cache,
+    }
 
 
-def unpack(filename):
-    """Unpack data from filename"""
-    with h5py.File(filename, 'r') as f:
+def is_pooled(filename, opts):
+    """Whether filename is read from the open files of opts['handles'] instead of being opened and closed"""
+    return opts['handles'] is not None and isinstance(filename, (str, os.PathLike))
+
+
+def open_file(filename, opts):
+    """Open filename for reading, as a single-writer/multiple-reader reader if opts['swmr'], or get it from
+    opts['handles']
+    """
+    if is_pooled(filename, opts):
+        return opts['handles'].get(filename, swmr=opts['swmr'])
+    elif opts['swmr']:
+        return h5py.File(filename, 'r', libver='latest', swmr=True)
+    return h5py.File(filename, 'r')
+
+
+def unpack(filename, path=(), lazy=False, **options):
+    """Unpack data from filename
+
+    Args:
+        filename: str, name of file to load, or a file-like object opened for binary reading
+        path: sequence of keys/indexes, to only read the item at data[path[0]][path[1]]... instead of the whole thing.
+            The nodes along the path are the only ones read.
+        lazy: bool, whether to return proxies (LazyDict, LazyIndexed, LazyArray) that read from the file on demand
+            instead of reading everything up front. The file stays open as long as the proxies are referenced; use
+            open() to close it deterministically.
+        as_array: bool, whether to return homogeneous lists and tuples as ndarrays instead of converting them to
+            lists/tuples of Python objects. Strs come back as a unicode array.
+        workers: int, number of threads to decompress gzip ndarrays' chunks with in parallel, instead of 1 chunk at a
+            time in HDF5. Ignored if lazy, since LazyArrays read their slices through HDF5.
+        mmap: bool, whether to return read-only np.memmaps straight into the file for ndarrays stored contiguous and
+            unfiltered (see pack's contiguous option), instead of copying them into memory. Other ndarrays are read as
+            usual. The memmaps stay valid after the file is closed.
+        stats: h5pack.stats.Stats to record each node's time, size, and encoding in
+        swmr: bool, whether to open the file as a single-writer/multiple-reader reader, to read a file that's being
+            written by a Writer with swmr=True. Datasets are refreshed as they're read, so they include items appended
+            up to then; if lazy, homogeneous lists and tuples come back as LazyLists, which read items on demand and can
+            be refreshed.
+        handles: h5pack.cache.HandlePool to get the file from, already open if it was read before, instead of opening
+            and closing it. Lazy proxies then stay usable until the pool closes the file.
+        cache: h5pack.cache.ValueCache to get the data (or the item at path) from if it was read before, instead of
+            decoding it again. ndarrays in cached data are read-only.
+    """
+    opts = read_opts(**options)
+    return unpack_file(open_file(filename, opts), path, lazy, opts, close=not is_pooled(filename, opts))
+
+
+def unpackb(buf, path=(), lazy=False, **options):
+    """Unpack data from bytes made by packb. Takes the same options as unpack."""
+    return unpack_file(open_image(buf), path, lazy, read_opts(**options))
+
+
+def unpack_file(f, path, lazy, opts, close=True):
+    """Read data from the open file f, then close it if close and not lazy"""
+    if lazy:  # Nothing would shut down a thread pool for workers, so they're ignored
+        return read_path(f, 'root', path, opts, lazy=True)
+
+    with f if close else contextlib.nullcontext(f), thread_pool(opts['workers']) as executor:
+        opts['executor'] = executor
+        if read_meta(f['root']).get('dedup'):  # Only packs made with dedup have datasets to memoize
+            opts['memo'] = {}
+
         # Recursively build up read data
-        data = read_data(f, 'root')
+        data = read_path(f, 'root', path, opts)
     return data
+
+
+@contextlib.contextmanager
+def open(filename, path=(), **options):
+    """Context manager for lazily reading filename. Yields the same proxies as unpack(filename, path, lazy=True,
+    **options) and closes the file on exit (unless it's from the handles option), after which the proxies can't be
+    used.
+    """
+    opts = read_opts(**options)
+    f = open_file(filename, opts)
+    close = not is_pooled(filename, opts)
+    with f if close else contextlib.nullcontext(f), thread_pool(opts['workers']) as executor:
+        opts['executor'] = executor
+        yield read_path(f, 'root', path, opts, lazy=True)
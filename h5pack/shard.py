@@ -0,0 +1,188 @@
+"""Packs split across several files (shards). The master file holds the root, whose items are HDF5 external links to
+where they're written in the shard files, and whose big ndarrays are virtual datasets over pieces (split along axis 0)
+in shard files. HDF5 follows both transparently, so the master file unpacks like any other pack.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import h5py
+import numpy as np
+
+from h5pack.chunks import thread_pool
+from h5pack.h5pack import clean_key, create_dataset, encode_indexed, indexed_types, is_dict_homogeneous, \
+    promote_dict, write_attrs, write_data, write_dedup_flag, write_indexed, write_opts
+
+
+def shard_filename(filename, i):
+    """Name of the i-th shard file of the pack in filename, like 'out-00000.h5' for 'out.h5'"""
+    stem, ext = os.path.splitext(filename)
+    return '{}-{:05d}{}'.format(stem, i, ext)
+
+
+def data_size(data):
+    """Rough number of bytes data takes to store, for splitting it into shards"""
+    data_type = type(data)
+    if data_type == np.ndarray:
+        return data.nbytes
+    elif data_type == str:
+        return len(data)
+    elif data_type == dict:
+        return sum(map(data_size, data.keys())) + sum(map(data_size, data.values()))
+    elif data_type in indexed_types or data_type == set:
+        return sum(map(data_size, data))
+    return 8
+
+
+def is_splittable(data, shard_size):
+    """Whether data is an ndarray too big for 1 shard that can be split along axis 0"""
+    return type(data) == np.ndarray and data.nbytes > shard_size and data.ndim > 0 and len(data) > 1
+
+
+def root_items(data, opts):
+    """If data would be stored as a heterogeneous dict, list, or tuple, return (name, key, val) of each of its items,
+    with key None for lists/tuples. Otherwise return None, along with what encode_indexed made for a list/tuple, if
+    anything.
+    """
+    data_type = type(data)
+    if data_type == dict:
+        if is_dict_homogeneous(data) or (opts['promote'] and promote_dict(data) is not None):
+            return None, None
+        return [(clean_key(k), k, v) for k, v in data.items()], None
+    elif data_type in indexed_types:
+        encoded = encode_indexed(data, promote=opts['promote'])
+        if encoded[0] != 'heterogeneous':
+            return None, encoded
+        return [('{}'.format(i), None, v) for i, v in enumerate(data)], None
+    return None, None
+
+
+def plan_shards(items, shard_size):
+    """Assign (name, key, val) items to shards of about shard_size bytes each, in order. Items bigger than that get a
+    shard to themselves, or are split into pieces of shards of their own if they're ndarrays.
+
+    Returns:
+        shards: list of (items, pieces) for each shard: the (name, key, val) items in it, and the (name, start, piece)
+            pieces in it, with piece holding rows start:start + len(piece) of the ndarray item name
+        split: list of the (name, key, val) items that were split into pieces
+    """
+    shards = []
+    split = []
+    current = None
+    current_size = 0
+    for name, key, val in items:
+        if is_splittable(val, shard_size):
+            rows = max(1, shard_size // val[0].nbytes) if val[0].nbytes else len(val)
+            for start in range(0, len(val), rows):
+                shards.append(([], [(name, start, val[start:start + rows])]))
+            split.append((name, key, val))
+            continue
+
+        size = data_size(val)
+        if current is None or (current_size + size > shard_size and current[0]):
+            current = ([], [])
+            current_size = 0
+            shards.append(current)
+        current[0].append((name, key, val))
+        current_size += size
+    return shards, split
+
+
+def write_shard(filename, data_type, items, pieces, options):
+    """Write a shard file: items under /root, like write_data would in the root group, and pieces under
+    /pieces/<name>/<start>
+    """
+    opts = write_opts(**options)
+    with h5py.File(filename, 'w') as f, thread_pool(opts['workers']) as executor:
+        opts['executor'] = executor
+        root = f.create_group('root')
+        for name, key, val in items:
+            write_data(root, name, val, opts, key_type=type(key) if data_type == dict else None)
+        for name, start, piece in pieces:
+            group = f.require_group('pieces/{}'.format(name))
+            if opts['contiguous']:
+                group.create_dataset('{}'.format(start), data=piece)
+            else:
+                create_dataset(group, '{}'.format(start), piece, opts)
+
+
+def write_virtual(group, name, key, val, sources, opts):
+    """Write the ndarray val, split into pieces in shard files, as a virtual dataset at group[name]. sources is a list
+    of (shard filename, start, piece) for the pieces.
+    """
+    layout = h5py.VirtualLayout(val.shape, val.dtype)
+    for filename, start, piece in sources:
+        path = '/pieces/{}/{}'.format(name, start)
+        layout[start:start + len(piece)] = h5py.VirtualSource(filename, path, piece.shape, dtype=piece.dtype)
+    ds = group.create_virtual_dataset(name, layout)
+    write_attrs(ds, {'data_type': np.ndarray, 'collection_type': 'primitive', 'key_type': key}, opts['compact'])
+    return ds
+
+
+def pack_sharded(data, filename, shard_size, processes=None, **options):
+    """Pack data into a master file filename plus shard files next to it named like shard_filename, of about
+    shard_size bytes of data each, written in parallel by processes worker processes. Unpack the master file as usual;
+    the shard files have to stay in the same directory as it.
+
+    If data is a heterogeneous dict, list, or tuple, its items are spread over the shards, with each ndarray bigger
+    than shard_size split along axis 0 over shards of its own. If data is such an ndarray itself, it's split that way.
+    Otherwise it's just packed into filename, since it's stored as 1 dataset (or a few) anyway.
+
+    Args:
+        data: Data to pack, like for pack
+        filename: str, name of the master file to write
+        shard_size: int, number of bytes of data to put in each shard
+        processes: int, number of processes to write shards in parallel, or None to write them in this process. Data
+            and options are pickled to send to the processes, so the policy option has to be picklable, and the stats
+            option is ignored.
+        options: Same options as pack, except that the root's items are never inlined with inline_scalars=True
+    """
+    opts = write_opts(**options)
+    items, encoded = root_items(data, opts)
+    if items is None and is_splittable(data, shard_size):
+        items = [('root', None, data)]
+    elif items is None:
+        with h5py.File(filename, 'w') as f, thread_pool(opts['workers']) as executor:
+            opts['executor'] = executor
+            if encoded is not None:
+                write_indexed(f, 'root', data, opts, encoded=encoded)
+            else:
+                write_data(f, 'root', data, opts)
+            if opts['links'] is not None:
+                write_dedup_flag(f['root'])
+        return
+
+    shards, split = plan_shards(items, shard_size)
+    filenames = [shard_filename(filename, i) for i in range(len(shards))]
+    if processes:
+        worker_options = {k: v for k, v in options.items() if k != 'stats'}  # Would be filled in the workers' copies
+        # Spawn instead of fork, since HDF5 isn't fork safe with files open
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(write_shard, shard, type(data), shard_items, pieces, worker_options)
+                       for shard, (shard_items, pieces) in zip(filenames, shards)]
+            for future in futures:
+                future.result()
+    else:
+        for shard, (shard_items, pieces) in zip(filenames, shards):
+            write_shard(shard, type(data), shard_items, pieces, options)
+
+    # Links are relative to the master file's directory, so the files can be moved together
+    link_names = [os.path.basename(shard) for shard in filenames]
+    with h5py.File(filename, 'w') as f:
+        if split and split[0][0] == 'root':  # data is a big ndarray
+            sources = [(link_name, start, piece) for link_name, (_, pieces) in zip(link_names, shards)
+                       for _, start, piece in pieces]
+            write_virtual(f, 'root', None, data, sources, opts)
+            return
+
+        data_type = type(data)
+        root = f.create_group('root')
+        write_attrs(root, {'data_type': data_type, 'collection_type': data_type, 'homogeneous': False,
+                           'dedup': True if opts['links'] is not None else None}, opts['compact'])
+        for link_name, (shard_items, _) in zip(link_names, shards):
+            for name, _, _ in shard_items:
+                root[name] = h5py.ExternalLink(link_name, '/root/{}'.format(name))
+        for name, key, val in split:
+            sources = [(link_name, start, piece) for link_name, (_, pieces) in zip(link_names, shards)
+                       for piece_name, start, piece in pieces if piece_name == name]
+            write_virtual(root, name, type(key) if data_type == dict else None, val, sources, opts)
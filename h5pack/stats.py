@@ -0,0 +1,165 @@
+"""Instrumentation of pack and unpack: per-node timings, sizes, and encodings, aggregated into a report"""
+import contextlib
+import heapq
+import json
+import operator
+import posixpath
+import time
+
+import h5py
+
+from h5pack.h5pack import is_collection_str, read_meta
+
+
+def node_encoding(meta):
+    """Short description of how an item is stored, like 'homogeneous list', 'records', or 'ndarray'"""
+    collection_type_str = meta['collection_type']
+    if is_collection_str(collection_type_str):
+        return '{} {}'.format('homogeneous' if bool(meta['homogeneous']) else 'heterogeneous', collection_type_str)
+    elif collection_type_str == 'primitive':
+        return meta['data_type']
+    return collection_type_str
+
+
+def node_datasets(node, meta):
+    """The datasets that hold the item at node, apart from its items that are their own nodes: node itself if it's a
+    dataset, or the datasets in it unless it's a heterogeneous collection
+    """
+    if isinstance(node, h5py.Dataset):
+        return [node]
+    elif is_collection_str(meta['collection_type']) and not bool(meta['homogeneous']):
+        return []
+    return [ds for ds in node.values() if isinstance(ds, h5py.Dataset)]
+
+
+class Stats:
+    """Collects what happens at each node (group or dataset) as pack or unpack recurse through the data. Pass it as the
+    stats option, then call report() or to_json(). It can be reused to accumulate several packs/unpacks.
+
+    Each node's record has:
+        op: 'pack' or 'unpack'
+        path: HDF5 path of the node, like '/root/a/0'
+        encoding: how the item is stored (see node_encoding), or 'link' for a dataset hard linked by pack(dedup=True)
+        time: seconds spent on the node, including its items that are their own nodes
+        self_time: seconds spent on the node, not including those items
+        objects: number of HDF5 groups and datasets made for the node (not including its items' nodes)
+        bytes_in: bytes of the node's datasets in memory
+        bytes_out: bytes of the node's datasets in the file, after compression
+
+    Pack also times these phases, across all nodes:
+        encode: checking item types and converting collections into arrays
+        datasets: creating datasets and writing data into them, including compression
+        other (in the report): creating groups, writing attrs, and everything else
+    Time spent measuring is left out of all times, though it makes packs/unpacks of many small items up to about 2x
+    slower overall.
+    """
+    def __init__(self):
+        self.nodes = []
+        self.phases = {}
+        self.totals = {}  # op -> seconds of top level packs/unpacks
+        self._stack = []  # [raw seconds of child nodes, seconds spent measuring] of each node being done
+        self._phase = None
+
+    def record(self, op, group, name, f, *args):
+        """Call f(*args), which writes or reads the node at group[name], and record it"""
+        frame = [0.0, 0.0]
+        self._stack.append(frame)
+        start = time.perf_counter()
+        try:
+            result = f(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._stack.pop()
+        measured = time.perf_counter()
+
+        node = group[name]
+        meta = read_meta(node)
+        datasets = node_datasets(node, meta)
+        encoding = node_encoding(meta)
+        objects = len(datasets) + isinstance(node, h5py.Group)
+        if op == 'pack' and isinstance(node, h5py.Dataset) and h5py.h5o.get_info(node.id).rc > 1:
+            encoding = 'link'
+            objects = 0
+            datasets = []
+        self.nodes.append({
+            'op': op,
+            'path': posixpath.join(group.name, name),
+            'encoding': encoding,
+            'time': elapsed - frame[1],
+            'self_time': elapsed - frame[0],
+            'objects': objects,
+            'bytes_in': sum(ds.nbytes for ds in datasets),
+            'bytes_out': sum(ds.id.get_storage_size() for ds in datasets),
+        })
+
+        overhead = time.perf_counter() - measured
+        if self._stack:
+            parent = self._stack[-1]
+            parent[0] += elapsed + overhead
+            parent[1] += frame[1] + overhead
+        else:
+            self.totals[op] = self.totals.get(op, 0.0) + elapsed - frame[1]
+        return result
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        """Add the time spent in the with block to phase. Nested timers only count the outer one."""
+        if self._phase is not None:
+            yield
+            return
+        self._phase = phase
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[phase] = self.phases.get(phase, 0.0) + time.perf_counter() - start
+            self._phase = None
+
+    def report(self, top=10):
+        """Aggregate the node records into a dict with, for each of pack and unpack that were done: total time, node,
+        object, and byte counts, pack's phase times, the same totals for each encoding, and the top slowest nodes by
+        self time
+        """
+        report = {}
+        for op in ['pack', 'unpack']:
+            nodes = [node for node in self.nodes if node['op'] == op]
+            if not nodes:
+                continue
+
+            encodings = {}
+            for node in nodes:
+                totals = encodings.setdefault(node['encoding'], {'nodes': 0, 'self_time': 0.0, 'objects': 0,
+                                                                 'bytes_in': 0, 'bytes_out': 0})
+                totals['nodes'] += 1
+                totals['self_time'] += node['self_time']
+                for k in ['objects', 'bytes_in', 'bytes_out']:
+                    totals[k] += node[k]
+
+            op_report = {
+                'time': self.totals.get(op, 0.0),
+                'nodes': len(nodes),
+                'objects': sum(node['objects'] for node in nodes),
+                'bytes_in': sum(node['bytes_in'] for node in nodes),
+                'bytes_out': sum(node['bytes_out'] for node in nodes),
+            }
+            if op == 'pack':
+                phases = dict(self.phases)
+                phases['other'] = max(op_report['time'] - sum(phases.values()), 0.0)
+                op_report['phases'] = phases
+            op_report['encodings'] = dict(sorted(encodings.items(), key=lambda item: -item[1]['self_time']))
+            op_report['slowest'] = heapq.nlargest(top, nodes, key=operator.itemgetter('self_time'))
+            report[op] = op_report
+        return report
+
+    def to_json(self, filename=None, top=10, nodes=False):
+        """Get the report as a JSON str, or write it to filename. If nodes, include every node's record."""
+        report = self.report(top)
+        if nodes:
+            report['nodes'] = self.nodes
+        if filename is None:
+            return json.dumps(report, indent=2)
+        with open(filename, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    def __repr__(self):
+        return '<Stats nodes={}>'.format(len(self.nodes))
@@ -0,0 +1,247 @@
+"""Streaming writer for packs that are built up over time instead of all at once"""
+from concurrent.futures import ThreadPoolExecutor
+
+import h5py
+import numpy as np
+
+from h5pack.h5pack import clean_key, encode_strs, filter_kwargs, in_scalars, is_vlen_str, read_data, read_meta, \
+    read_opts, read_scalars, str_dtype, str_type_map, write_attrs, write_data, write_dedup_flag, write_dict_item, \
+    write_heterogeneous, write_opts
+
+# Item types that can go in a growable homogeneous list dataset
+appendable_types = {int, float, str, bool}
+
+# Collection types of lists that pack stores as a group of datasets, which are converted to heterogeneous to append to
+packed_collection_types = {'records', 'ragged', 'promoted'}
+
+
+def is_appendable_type(x_type):
+    return x_type in appendable_types or issubclass(x_type, np.number)
+
+
+def encode_items(items, item_type):
+    """Convert homogeneous items into the array that's stored for them, like write_indexed does"""
+    if item_type == str:
+        return encode_strs(items)
+    elif item_type == bool:
+        return np.int8(items)
+    return np.asarray(items, dtype=None if item_type in appendable_types else item_type)
+
+
+class Writer:
+    """Write a pack incrementally. The root is a heterogeneous dict: each key holds either a value written in one go with
+    write() (or w[key] = value), or a list that's grown with append()/extend(). Lists of ints, floats, strs, bools, or
+    Numpy numbers are stored as resizable chunked datasets; lists of anything else grow by adding indexed subgroups.
+    Either way they unpack as ordinary lists.
+
+    Everything written is in the file, so memory use stays bounded. Call flush() to make sure it's on disk.
+
+    With swmr=True, the file can be read while it's being written, once start_swmr() is called (see it for what can
+    still be written then).
+
+    Usage:
+        with Writer(filename) as w:
+            w['config'] = config
+            for step in range(n):
+                w.append('losses', loss)
+
+        with Writer(filename, swmr=True) as w:
+            w['config'] = config
+            w.create_list('losses', float)
+            w.start_swmr()
+            for step in range(n):
+                w.append('losses', loss)  # Readers with unpack(filename, swmr=True) see it right away
+    """
+    def __init__(self, filename, mode='w', chunk_size=1024, swmr=False, **options):
+        """
+        Args:
+            filename: str, name of file to write, or a file-like object
+            mode: str, 'w' to start a new file, or 'a' to keep adding to one made by Writer (or a pack of a dict)
+            chunk_size: int, number of items per chunk of growable list datasets
+            swmr: bool, whether to write a file that can be read while it's being written, after start_swmr(). The
+                file uses the latest HDF5 format, which needs HDF5 1.10+ to read.
+            options: Same options as pack
+        """
+        self.f = h5py.File(filename, mode, libver='latest' if swmr else None)
+        self.swmr = swmr
+        self.chunk_size = chunk_size
+        self.opts = write_opts(**options)
+        if self.opts['workers']:
+            self.opts['executor'] = ThreadPoolExecutor(self.opts['workers'])
+
+        if 'root' in self.f:
+            self.root = self.f['root']
+            meta = read_meta(self.root)
+            if meta['collection_type'] != 'dict' or bool(meta['homogeneous']):
+                self.close()
+                raise ValueError('Can only add to a file whose root is a heterogeneous dict')
+        else:
+            self.root = self.f.create_group('root')
+            write_attrs(self.root, {'data_type': dict, 'collection_type': dict, 'homogeneous': False},
+                        self.opts['compact'])
+        if self.opts['links'] is not None and not read_meta(self.root).get('dedup'):
+            write_dedup_flag(self.root)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __setitem__(self, key, value):
+        self.write(key, value)
+
+    def write(self, key, value):
+        """Write value under key, replacing whatever was there"""
+        if self.f.swmr_mode:
+            raise ValueError('Can only append to lists stored as datasets after start_swmr()')
+        write_dict_item(self.root, key, value, self.opts)
+
+    def create_list(self, key, item_type, str_len=None):
+        """Start an empty list under key, replacing whatever was there, stored as a growable dataset of item_type items:
+        int, float, str, bool, or a Numpy number type. Lists have to be there before start_swmr() to be appended to
+        after it.
+
+        Args:
+            key: Key of the list
+            item_type: type of the items
+            str_len: int, number of bytes of UTF-8 that strs appended after start_swmr() can have. By default the list
+                is just widened to fit the strs appended before then.
+        """
+        if self.f.swmr_mode:
+            raise ValueError('Can only append to lists stored as datasets after start_swmr()')
+        if not is_appendable_type(item_type):
+            raise ValueError('Lists of {} can\'t be stored as datasets'.format(item_type.__name__))
+        name = clean_key(key)
+        if name in self.root:
+            del self.root[name]
+        if item_type == str and str_len is not None:
+            dtype = 'S{}'.format(str_len)
+        else:
+            dtype = self._encode_items([item_type()], item_type).dtype
+        self._create_dataset(name, key, dtype, item_type)
+
+    def start_swmr(self):
+        """Switch the file to single-writer/multiple-reader mode, so that it can be read (with unpack or open with
+        swmr=True) while it's being written. HDF5 can't add groups, datasets, or attrs in this mode, so after this the
+        only change allowed is appending to lists that are already stored as datasets: ones made by create_list(), or
+        by appending ints, floats, strs, bools, or Numpy numbers of 1 type. Strs have to fit in the list's width.
+        Appended items are flushed right away so readers see them.
+        """
+        if not self.swmr:
+            raise ValueError('Writer has to be made with swmr=True to start SWMR mode')
+        self.f.swmr_mode = True
+
+    def append(self, key, item):
+        """Add item to the end of the list under key, starting the list if it's not there"""
+        self.extend(key, [item])
+
+    def extend(self, key, items):
+        """Add items to the end of the list under key, starting the list if it's not there"""
+        items = list(items)
+        if len(items) == 0:
+            return
+
+        name = clean_key(key)
+        item_type = type(items[0])
+        homogeneous = is_appendable_type(item_type) and all(type(item) == item_type for item in items)
+        if self.f.swmr_mode and not (name in self.root and isinstance(self.root[name], h5py.Dataset) and homogeneous
+                                     and str_type_map[read_meta(self.root[name])['data_type']] == item_type):
+            raise ValueError('Can only append items of the same type to lists stored as datasets after start_swmr()')
+        if name not in self.root:
+            if in_scalars(read_scalars(read_meta(self.root)), key):  # Written with inline_scalars=True
+                raise ValueError('Item under {} isn\'t a list'.format(key))
+        else:
+            meta = read_meta(self.root[name])
+            if meta['collection_type'] == 'list' and meta['data_type'] == 'NoneType':  # Empty list from pack
+                del self.root[name]
+        if name not in self.root:
+            if homogeneous:
+                self._create_dataset(name, key, self._encode_items(items[:1], item_type).dtype, item_type)
+            else:
+                write_heterogeneous(self.root, name, list, [], self.opts, type(key))
+
+        node = self.root[name]
+        meta = read_meta(node)
+        if meta['collection_type'] in packed_collection_types and meta['data_type'] == 'list':
+            node = self._convert_to_group(name)
+            meta = read_meta(node)
+        if meta['collection_type'] != 'list':
+            raise ValueError('Item under {} isn\'t a list'.format(key))
+
+        if isinstance(node, h5py.Dataset):
+            if homogeneous and str_type_map[meta['data_type']] == item_type:
+                self._extend_dataset(name, items, item_type)
+                return
+            node = self._convert_to_group(name)
+
+        n = len(node)
+        for i, item in enumerate(items):
+            write_data(node, '{}'.format(n + i), item, self.opts)
+
+    def _encode_items(self, items, item_type):
+        """encode_items, except that strs are kept fixed-width for SWMR, since HDF5 can't read variable-length strs
+        while they're being written
+        """
+        if self.swmr and item_type == str:
+            return np.array([item.encode('utf-8') for item in items], dtype=bytes)
+        return encode_items(items, item_type)
+
+    def _create_dataset(self, name, key, dtype, item_type):
+        """Start an empty growable homogeneous list dataset"""
+        ds_kwargs = {k: v for k, v in filter_kwargs(self.opts['ds_kwargs'], dtype).items() if k != 'chunks'}
+        ds = self.root.create_dataset(name, shape=(0,), maxshape=(None,), chunks=(self.chunk_size,), dtype=dtype,
+                                      **ds_kwargs)
+        write_attrs(ds, {'data_type': item_type, 'collection_type': list, 'homogeneous': True,
+                         'key_type': type(key)}, self.opts['compact'])
+
+    def _extend_dataset(self, name, items, item_type):
+        ds = self.root[name]
+        vals = self._encode_items(items, item_type)
+        if item_type == str and not is_vlen_str(ds.dtype):
+            if is_vlen_str(vals.dtype):  # Non-ASCII or much longer strs
+                ds = self._replace_dataset(name, str_dtype)
+            elif vals.dtype.itemsize > ds.dtype.itemsize:  # Widen to fit the longer strs
+                ds = self._replace_dataset(name, 'S{}'.format(max(vals.dtype.itemsize, 2 * ds.dtype.itemsize)))
+        elif item_type == str and self.swmr:
+            raise ValueError('Can\'t append to the variable-length str list under {} with swmr=True'.format(name))
+        if ds.maxshape != (None,):  # Fixed size list from pack
+            ds = self._replace_dataset(name, ds.dtype)
+        n = len(ds)
+        ds.resize((n + len(vals),))
+        ds[n:] = vals
+        if self.f.swmr_mode:
+            ds.flush()
+
+    def _replace_dataset(self, name, dtype):
+        """Copy a homogeneous list dataset into a new growable one with dtype"""
+        if self.f.swmr_mode:
+            raise ValueError('Items don\'t fit in the list under {} after start_swmr()'.format(name))
+        old = self.root[name]
+        vals = old[...]
+        attrs = dict(old.attrs)
+        ds_kwargs = {k: v for k, v in filter_kwargs(self.opts['ds_kwargs'], dtype).items() if k != 'chunks'}
+        del self.root[name]
+        ds = self.root.create_dataset(name, data=vals.astype(dtype), maxshape=(None,), chunks=(self.chunk_size,),
+                                      **ds_kwargs)
+        ds.attrs.update(attrs)
+        return ds
+
+    def _convert_to_group(self, name):
+        """Turn a homogeneous list dataset into a heterogeneous list subgroup, for when an item of another type is
+        appended, or a list that pack stored as a group of datasets (like records) into one, to append to it
+        """
+        meta = read_meta(self.root[name])
+        vals = read_data(self.root, name, read_opts(), meta)
+        del self.root[name]
+        return write_heterogeneous(self.root, name, list, vals, self.opts, meta['key_type'])
+
+    def flush(self):
+        """Flush everything written so far to disk"""
+        self.f.flush()
+
+    def close(self):
+        if self.f:
+            self.f.close()
+        if self.opts['executor'] is not None:
+            self.opts['executor'].shutdown()
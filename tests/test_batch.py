@@ -0,0 +1,75 @@
+import unittest
+import tempfile
+import os
+import numpy as np
+from h5pack import pack_many, unpack_many
+from h5pack.batch import shutdown
+
+
+class TestBatch(unittest.TestCase):
+    """Test packing and unpacking many files with pack_many and unpack_many"""
+    def run(self, result=None):
+        with tempfile.TemporaryDirectory() as tempdir:
+            self.tempdir = tempdir
+            super().run(result)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutdown()
+
+    def filenames(self, n):
+        return [os.path.join(self.tempdir, '{}.h5'.format(i)) for i in range(n)]
+
+    def check(self, processes, chunksize):
+        items = [{'id': i, 'x': np.arange(i), 'tags': ['a', 'b']} for i in range(10)]
+        items[4] = {'bad': object()}  # Can't be packed
+        filenames = self.filenames(len(items))
+
+        packed = list(pack_many(items, filenames, processes=processes, chunksize=chunksize, compact=True))
+        self.assertEqual(sorted(filename for filename, _ in packed), sorted(filenames))
+        errors = {filename: error for filename, error in packed}
+        self.assertIsInstance(errors.pop(filenames[4]), TypeError)
+        self.assertTrue(all(error is None for error in errors.values()))
+
+        unpacked = list(unpack_many(filenames + [os.path.join(self.tempdir, 'missing.h5')], processes=processes,
+                                    chunksize=chunksize, as_array=True))
+        self.assertEqual(len(unpacked), len(filenames) + 1)
+        for filename, data, error in unpacked:
+            if filename in filenames[:4] + filenames[5:]:
+                i = filenames.index(filename)
+                self.assertIsNone(error)
+                self.assertEqual(data['id'], i)
+                np.testing.assert_array_equal(data['x'], np.arange(i))
+                np.testing.assert_array_equal(data['tags'], ['a', 'b'])
+            else:  # Partly written or missing
+                self.assertIsNone(data)
+                self.assertIsInstance(error, KeyError if filename == filenames[4] else OSError)
+
+    def test_in_process(self):
+        self.check(None, 1)
+
+    def test_processes(self):
+        self.check(2, 1)
+        self.check(2, 3)  # Reuses the pool
+
+    def test_generator(self):
+        n = 50
+        filenames = self.filenames(n)
+        packed = pack_many(([i] * i for i in range(n)), iter(filenames), processes=2, chunksize=4)
+        self.assertTrue(all(error is None for _, error in packed))
+        for filename, data, error in unpack_many(filenames, processes=2, chunksize=4):
+            self.assertEqual(data, [filenames.index(filename)] * filenames.index(filename))
+
+    def test_lengths(self):
+        filenames = self.filenames(3)
+        with self.assertRaises(ValueError):
+            pack_many([1, 2], filenames)  # Checked before anything's packed
+        packed = pack_many(iter([1, 2]), iter(filenames))
+        self.assertEqual(next(packed), (filenames[0], None))
+        self.assertEqual(next(packed), (filenames[1], None))
+        with self.assertRaises(ValueError):
+            next(packed)
+
+
+if __name__ == '__main__':
+    unittest.main()
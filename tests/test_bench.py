@@ -0,0 +1,34 @@
+import unittest
+import tempfile
+import os
+import io
+import json
+import contextlib
+from h5pack import bench
+
+
+class TestBench(unittest.TestCase):
+    """Smoke test of the benchmarks at a tiny scale"""
+    def run(self, result=None):
+        with tempfile.TemporaryDirectory() as tempdir:
+            self.filename = os.path.join(tempdir, 'results.json')
+            super().run(result)
+
+    def test_bench(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            bench.main(['--scale', '0.001', '--configs', 'default,compact,contiguous_mmap', '--no-isolate',
+                        '--json', self.filename])
+        with open(self.filename) as f:
+            results = json.load(f)
+        self.assertEqual(len(results), 3 * len(bench.workloads))
+        for result in results:
+            self.assertNotIn('error', result)
+            self.assertGreater(result['pack_objects_per_s'], 0)
+            self.assertGreater(result['size_mb'], 0)
+        self.assertEqual(len(out.getvalue().splitlines()), len(results) + 1)
+
+    def test_isolated(self):
+        result = bench.run_case('list_int', 'default', scale=0.001)
+        self.assertNotIn('error', result)
+        self.assertGreater(result['unpack_mb_per_s'], 0)
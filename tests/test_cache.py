@@ -0,0 +1,141 @@
+import unittest
+import tempfile
+import os
+import numpy as np
+import h5pack
+from h5pack import pack, unpack
+from h5pack.cache import HandlePool, ValueCache
+
+
+class TestHandlePool(unittest.TestCase):
+    """Test reading through a pool of open files"""
+    def run(self, result=None):
+        with tempfile.TemporaryDirectory() as tempdir:
+            self.tempdir = tempdir
+            self.filename = os.path.join(tempdir, 'tempfile')
+            super().run(result)
+
+    def test_reuse(self):
+        x = {'a': np.arange(100.0), 'b': [1, 'two'], 'c': {'d': 'e'}}
+        pack(x, self.filename)
+        handles = HandlePool(rdcc_nbytes=4 * 2 ** 20, rdcc_nslots=10007)
+        for _ in range(3):
+            x_ = unpack(self.filename, handles=handles)
+            np.testing.assert_array_equal(x_['a'], x['a'])
+            self.assertEqual(x_['b'], x['b'])
+        self.assertEqual(unpack(self.filename, path=('c', 'd'), handles=handles), 'e')
+        with h5pack.open(self.filename, handles=handles) as data:
+            self.assertEqual(data['b'][1], 'two')
+        self.assertEqual(unpack(self.filename, lazy=True, handles=handles)['c']['d'], 'e')
+        self.assertEqual((handles.hits, handles.misses), (5, 1))
+        self.assertEqual(len(handles), 1)
+
+        f = handles.get(self.filename)
+        self.assertTrue(f)  # Still open
+        self.assertEqual(f.id.get_access_plist().get_cache()[1:3], (10007, 4 * 2 ** 20))
+
+        handles.discard(self.filename)
+        self.assertFalse(f)
+        self.assertEqual(len(handles), 0)
+        pack([1, 2], self.filename)  # Can write it again
+        self.assertEqual(unpack(self.filename, handles=handles), [1, 2])
+
+    def test_changed(self):
+        handles = HandlePool()
+        pack({'a': 1}, self.filename)
+        self.assertEqual(unpack(self.filename, handles=handles), {'a': 1})
+
+        # Replace it the way a deploy would
+        new_filename = os.path.join(self.tempdir, 'new')
+        pack({'a': 2}, new_filename)
+        os.replace(new_filename, self.filename)
+        self.assertEqual(unpack(self.filename, handles=handles), {'a': 2})
+        self.assertEqual((handles.hits, handles.misses), (0, 2))
+        self.assertEqual(len(handles), 1)
+
+    def test_evict(self):
+        handles = HandlePool(size=2)
+        filenames = [os.path.join(self.tempdir, '{}.h5'.format(i)) for i in range(3)]
+        for i, filename in enumerate(filenames):
+            pack(i, filename)
+        files = [handles.get(filename) for filename in filenames]
+        self.assertEqual(len(handles), 2)
+        self.assertFalse(files[0])
+        self.assertTrue(files[1] and files[2])
+
+        handles.get(filenames[1])  # Now most recently used
+        handles.get(filenames[0])
+        self.assertFalse(files[2])
+        self.assertEqual([unpack(filename, handles=handles) for filename in filenames], [0, 1, 2])
+
+        handles.clear()
+        self.assertEqual(len(handles), 0)
+        self.assertFalse(files[1])
+
+
+class TestValueCache(unittest.TestCase):
+    """Test reading through a cache of decoded values"""
+    def run(self, result=None):
+        with tempfile.TemporaryDirectory() as tempdir:
+            self.tempdir = tempdir
+            self.filename = os.path.join(tempdir, 'tempfile')
+            super().run(result)
+
+    def test_cache(self):
+        x = {'config': {'lr': 0.1, 'layers': [64, 'relu'], 'tags': {'a', 'b'}}, 'table': np.arange(1000.0),
+             'names': ['x', 'y'], 'pairs': ((1, 2), [3, 'z'])}
+        pack(x, self.filename)
+        cache = ValueCache()
+        x1 = unpack(self.filename, cache=cache)
+        x2 = unpack(self.filename, cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(len(cache), 1)  # Only the root, which holds the rest
+        for x_ in [x1, x2]:
+            self.assertEqual(x_['config'], x['config'])
+            np.testing.assert_array_equal(x_['table'], x['table'])
+            self.assertEqual(x_['pairs'], x['pairs'])
+
+        # Shared arrays are read-only, and containers are copies
+        self.assertIs(x1['table'], x2['table'])
+        self.assertFalse(x1['table'].flags.writeable)
+        with self.assertRaises(ValueError):
+            x1['table'][0] = 5
+        x1['config']['layers'].append(5)
+        x1['names'][0] = 'changed'
+        x1['pairs'][1][0] = 0
+        x3 = unpack(self.filename, cache=cache)
+        self.assertEqual(x3['config'], x['config'])
+        self.assertEqual(x3['names'], x['names'])
+        self.assertEqual(x3['pairs'], x['pairs'])
+
+        # Paths, options, and lazy items are cached separately
+        self.assertEqual(unpack(self.filename, path=('config',), cache=cache), x['config'])
+        self.assertEqual(unpack(self.filename, path=('config',), cache=cache), x['config'])
+        self.assertIsInstance(unpack(self.filename, path=('names',), as_array=True, cache=cache), np.ndarray)
+        with h5pack.open(self.filename, cache=cache) as data:
+            self.assertEqual(data['names'], x['names'])
+        info = cache.info()
+        self.assertEqual((info['hits'], info['misses'], info['entries']), (3, 4, 4))
+        self.assertGreater(info['nbytes'], 8000)
+
+        # Changed file is read again
+        pack({'config': 1}, self.filename)
+        self.assertEqual(unpack(self.filename, cache=cache), {'config': 1})
+        self.assertEqual(cache.misses, 5)
+
+        cache.clear()
+        self.assertEqual((len(cache), cache.nbytes), (0, 0))
+
+    def test_budget(self):
+        cache = ValueCache(max_bytes=20000)
+        pack({'a': np.zeros(1000), 'b': np.ones(1000), 'c': np.zeros(5000), 'd': np.ones(1000)}, self.filename)
+        for k in ['a', 'b', 'a', 'c', 'd', 'a']:
+            unpack(self.filename, path=(k,), cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+        self.assertEqual(len(cache), 2)  # c is too big, and b was evicted for d since a was used more recently
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.nbytes, 16000)
+        self.assertIn('entries=2', repr(cache))
+
+if __name__ == '__main__':
+    unittest.main()
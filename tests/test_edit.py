@@ -0,0 +1,131 @@
+import unittest
+import tempfile
+import os
+import subprocess
+import sys
+import numpy as np
+import h5py
+from h5pack import pack, unpack, update, delete, repack
+
+
+class TestEdit(unittest.TestCase):
+    """Test changing packs in place with update, delete, and repack"""
+    def run(self, result=None):
+        with tempfile.TemporaryDirectory() as tempdir:
+            self.filename = os.path.join(tempdir, 'tempfile')
+            super().run(result)
+
+    def test_update_heterogeneous(self):
+        x = {'a': [1, 'b', 2.0], 'c': {'d': 1, 2: 'e'}, 'f': np.arange(5)}
+        pack(x, self.filename)
+
+        update(self.filename, ('a', 1), 'z')
+        update(self.filename, ('a', -1), [3, 4])
+        update(self.filename, ('c', 2), None)
+        update(self.filename, ('c', 'g'), (5,))
+        update(self.filename, ('f',), np.zeros(2))
+        x_ = unpack(self.filename)
+        self.assertEqual(x_['a'], [1, 'z', [3, 4]])
+        self.assertEqual(x_['c'], {'d': 1, 2: None, 'g': (5,)})
+        np.testing.assert_array_equal(x_['f'], np.zeros(2))
+
+        with self.assertRaises(IndexError):
+            update(self.filename, ('a', 3), 1)
+        with self.assertRaises(KeyError):
+            update(self.filename, ('c', '2'), 1)  # Same group name as the int key 2
+
+        update(self.filename, (), [1, 2])
+        self.assertEqual(unpack(self.filename), [1, 2])
+
+    def test_update_homogeneous(self):
+        x = {'l': [1, 2, 3], 't': ('ab', 'cd'), 'd': {'a': 1.0, 'b': 2.0}, 'flags': [True, False]}
+        pack(x, self.filename)
+
+        # Same type - written in place
+        update(self.filename, ('l', 0), 10)
+        update(self.filename, ('t', 1), 'x')
+        update(self.filename, ('d', 'b'), 5.0)
+        update(self.filename, ('flags', 1), True)
+        x_ = unpack(self.filename)
+        self.assertEqual(x_, {'l': [10, 2, 3], 't': ('ab', 'x'), 'd': {'a': 1.0, 'b': 5.0}, 'flags': [True, True]})
+
+        # Other type, longer str, or new key - rewritten
+        update(self.filename, ('l', 1), 'y')
+        update(self.filename, ('t', 0), 'longer')
+        update(self.filename, ('d', 'c'), 3.0)
+        update(self.filename, ('d', 1), 4.0)
+        x_ = unpack(self.filename)
+        self.assertEqual(x_['l'], [10, 'y', 3])
+        self.assertEqual(x_['t'], ('longer', 'x'))
+        self.assertEqual(x_['d'], {'a': 1.0, 'b': 5.0, 'c': 3.0, 1: 4.0})
+        with h5py.File(self.filename, 'r') as f:
+            self.assertFalse(f['root/d'].attrs['homogeneous'])
+            self.assertEqual(f['root/d'].attrs['key_type'], 'str')
+
+        pack({'s': {1, 2}}, self.filename)
+        with self.assertRaises(TypeError):
+            update(self.filename, ('s', 0), 3)
+
+    def test_update_records_ragged(self):
+        x = {'r': [{'a': i, 'b': float(i)} for i in range(5)], 'g': [np.ones(i) for i in range(1, 4)]}
+        pack(x, self.filename)
+
+        update(self.filename, ('r', 2, 'a'), 20)
+        update(self.filename, ('g', 0), np.zeros(4))
+        x_ = unpack(self.filename)
+        self.assertEqual(x_['r'][2], {'a': 20, 'b': 2.0})
+        np.testing.assert_array_equal(x_['g'][0], np.zeros(4))
+        with h5py.File(self.filename, 'r') as f:
+            self.assertEqual(f['root/r'].attrs['collection_type'], 'records')
+
+    def test_delete(self):
+        x = {'a': [1, 'b', 2.0, None], 'c': {'d': 1, 'e': 'f'}, 'l': [1, 2, 3], 'h': {'i': 1, 'j': 2}}
+        pack(x, self.filename)
+
+        delete(self.filename, ('a', 1))
+        delete(self.filename, ('c', 'e'))
+        delete(self.filename, ('l', 0))
+        delete(self.filename, ('h', 'i'))
+        self.assertEqual(unpack(self.filename), {'a': [1, 2.0, None], 'c': {'d': 1}, 'l': [2, 3], 'h': {'j': 2}})
+        self.assertEqual(unpack(self.filename, path=('a', 2)), None)
+
+        with self.assertRaises(KeyError):
+            delete(self.filename, ('c', 'e'))
+        with self.assertRaises(ValueError):
+            delete(self.filename, ())
+
+    def test_inline_scalars(self):
+        x = {'a': 1, 'b': 'c', 'd': [1, 'e'], 'f': {'g': 2.5, 'h': None}}
+        for compact in [False, True]:
+            pack(x, self.filename, inline_scalars=True, compact=compact)
+            update(self.filename, ('a',), [1, 2])
+            update(self.filename, ('d',), 3, inline_scalars=True)
+            update(self.filename, ('f', 'g'), 'x')
+            update(self.filename, ('f', 'i'), True, inline_scalars=True)
+            delete(self.filename, ('b',))
+            delete(self.filename, ('f', 'h'))
+            self.assertEqual(unpack(self.filename), {'a': [1, 2], 'd': 3, 'f': {'g': 'x', 'i': True}})
+            with h5py.File(self.filename, 'r') as f:
+                self.assertEqual(sorted(f['root']), ['a', 'f'])
+                self.assertEqual(sorted(f['root/f']), ['g'])
+            with self.assertRaises(KeyError):
+                delete(self.filename, ('b',))
+
+    def test_repack(self):
+        x = {'big': np.random.rand(100000), 'small': [1, 2, 3]}
+        pack(x, self.filename, compression=False)
+        delete(self.filename, ('big',))
+        size = os.path.getsize(self.filename)
+
+        out_filename = self.filename + '.out'
+        repack(self.filename, out_filename)
+        self.assertLess(os.path.getsize(out_filename), size / 10)
+        self.assertEqual(unpack(out_filename), {'small': [1, 2, 3]})
+
+        subprocess.run([sys.executable, '-m', 'h5pack', 'repack', self.filename], check=True)
+        self.assertLess(os.path.getsize(self.filename), size / 10)
+        self.assertEqual(unpack(self.filename), {'small': [1, 2, 3]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,14 @@
 import unittest
 import tempfile
 import os
+import io
+import json
 import numpy as np
-from h5pack import pack, unpack
+import h5py
+import h5pack
+from h5pack import pack, unpack, packb, unpackb, update
+from h5pack.h5pack import LazyArray, LazyDict, LazyIndexed, read_meta
+from h5pack.stats import Stats
 
 
 class TestH5Pack(unittest.TestCase):
@@ -78,6 +84,24 @@ class TestH5Pack(unittest.TestCase):
     def test_list_strs(self):
         self.check_roundtrip(['abc', 'def', 'ghij'])
 
+    def test_unicode_strs(self):
+        self.check_roundtrip('naïve ☃')
+        self.check_roundtrip(['abc', 'día', '日本'])
+        self.check_roundtrip({'día': 'noche', 'b': 'c'})
+        self.check_roundtrip({'a': ['ü', 1], 'b': ('x', 'é')})
+
+    def test_list_strs_vlen(self):
+        x = ['a', 'bc'] * 5000 + ['d' * 10000]
+        pack(x, self.filename, compression=False)
+        self.assertLess(os.path.getsize(self.filename), 1000000)  # Fixed-width would be 100 MB
+        with h5py.File(self.filename, 'r') as f:
+            self.assertIsNone(h5py.check_string_dtype(f['root'].dtype).length)
+        self.assertEqual(unpack(self.filename), x)
+        self.assertEqual(unpack(self.filename, path=(-1,)), x[-1])
+        x_ = unpack(self.filename, as_array=True)
+        self.assertEqual(x_.dtype.kind, 'U')
+        self.assertEqual(x_.tolist(), x)
+
     def test_list_bools(self):
         self.check_roundtrip([True, False, True])
 
@@ -87,9 +111,29 @@ class TestH5Pack(unittest.TestCase):
     def test_list_ints(self):
         self.check_roundtrip([1, 2, 3, 4])
 
+    def test_list_big_ints(self):
+        for x in [[-1, 2 ** 63], [2 ** 63, 2 ** 64 - 1]]:  # Stored as float64 and uint64
+            self.check_roundtrip(x)
+            self.assertEqual(list(map(type, unpack(self.filename))), [int, int])
+
     def test_list_floats(self):
         self.check_roundtrip([1.23, 4.56, 7.89])
 
+    def test_list_npnums(self):
+        x = [np.float32(1.5), np.float32(2.5)]
+        pack(x, self.filename)
+        x_ = unpack(self.filename)
+        self.assertEqual(x, x_)
+        self.assertIsInstance(x_[0], np.float32)
+
+    def test_as_array(self):
+        pack({'a': [1, 2, 3], 'b': ('x', 'yz'), 'c': [True, False], 'd': {1, 2}}, self.filename)
+        x_ = unpack(self.filename, as_array=True)
+        np.testing.assert_array_equal(x_['a'], np.array([1, 2, 3]))
+        np.testing.assert_array_equal(x_['b'], np.array(['x', 'yz']))
+        self.assertEqual(x_['c'].dtype, bool)
+        self.assertEqual(x_['d'], {1, 2})
+
     def test_tuple_strs(self):
         self.check_roundtrip(('abc', 'def', 'ghij'))
 
@@ -145,6 +189,9 @@ class TestH5Pack(unittest.TestCase):
             'b': [True, True, False]
         })
 
+    def test_dict_nones(self):
+        self.check_roundtrip({'a': None, 'b': None})
+
     # Homogeneous sets
     def test_set_int(self):
         self.check_roundtrip({1, 2, 3})
@@ -159,6 +206,12 @@ class TestH5Pack(unittest.TestCase):
     def test_set_mixed(self):
         self.check_roundtrip({1, 'a'})
 
+    def test_set_tuples(self):
+        self.check_roundtrip({(1, 2), (3, 4)})  # Not stored ragged
+
+    def test_set_nones(self):
+        self.check_roundtrip({None})
+
     # Mixed everything
     def test_nested_list_dict(self):
         self.check_roundtrip([{'x': 1.2, 'y': 3.5}, 1])
@@ -177,6 +230,64 @@ class TestH5Pack(unittest.TestCase):
         }
         self.check_roundtrip(x)
 
+    # Records (list of dicts with the same keys)
+    def test_list_records(self):
+        x = [{'x': 1.2, 'y': 3.5, 'id': i, 'name': 'r{}'.format(i), 1: True} for i in range(5)]
+        self.check_roundtrip(x)
+        x_ = unpack(self.filename)
+        self.assertEqual(list(x_[0].keys()), list(x[0].keys()))
+
+    def test_tuple_records(self):
+        self.check_roundtrip(({'a': 1}, {'a': 2}))
+
+    def test_records_mismatched(self):
+        self.check_roundtrip([{'x': 1, 'y': 2}, {'x': 3}])
+        self.check_roundtrip([{'x': 1}, {'x': 'a'}])
+        self.check_roundtrip([{'x': 1, 'y': None}, {'x': 2, 'y': None}])
+        self.check_roundtrip([{'x': [1, 2]}, {'x': [3]}])
+        self.check_roundtrip([{}, {}])
+
+    def test_records_path(self):
+        x = {'r': [{'x': i * 1.5, 'id': i} for i in range(10)]}
+        pack(x, self.filename)
+        self.assertEqual(unpack(self.filename, path=('r', 3)), x['r'][3])
+        self.assertEqual(unpack(self.filename, path=('r', -1, 'id')), 9)
+        with self.assertRaises(KeyError):
+            unpack(self.filename, path=('r', 0, 'z'))
+        with self.assertRaises(IndexError):
+            unpack(self.filename, path=('r', 10))
+
+    # Ragged (list of variable-length numeric vectors)
+    def test_list_ragged_lists(self):
+        self.check_roundtrip([[1, 2], [3, 4, 5], [], [6]])
+        self.check_roundtrip(((1.5,), (2.5, 3.5)))
+        self.check_roundtrip([[np.float32(1.5)], [np.float32(2.5), np.float32(3.5)]])
+
+    def test_list_ragged_ndarrays(self):
+        x = [np.ones(3), np.arange(7, dtype=np.float64), np.zeros(0)]
+        self.check_roundtrip_ndarrays(x)
+        x_ = unpack(self.filename)
+        self.assertEqual(len(x_), 3)
+        self.assertEqual(x_[1].dtype, np.float64)
+
+    def test_ragged_mismatched(self):
+        self.check_roundtrip([[1, 2], [3.5]])
+        self.check_roundtrip([[1, 2], (3,)])
+        self.check_roundtrip([['a'], ['b', 'c']])
+        self.check_roundtrip([[True], [False]])
+        self.check_roundtrip([[], []])
+        self.check_roundtrip([[-1], [2 ** 63 + 1]])  # Would be float64, which can't hold it exactly
+        self.check_roundtrip_ndarrays([np.ones(3), np.ones(2, dtype=np.int32)])
+
+    def test_ragged_path(self):
+        x = {'r': [np.arange(i) for i in range(5)], 'l': [[1], [2, 3]]}
+        pack(x, self.filename)
+        np.testing.assert_array_equal(unpack(self.filename, path=('r', 3)), np.arange(3))
+        np.testing.assert_array_equal(unpack(self.filename, path=('r', -1)), np.arange(4))
+        self.assertEqual(unpack(self.filename, path=('l', 1)), [2, 3])
+        with self.assertRaises(IndexError):
+            unpack(self.filename, path=('l', 2))
+
     # Mixed numpy arrays
     def test_mixed_ndarrays(self):
         x = [np.zeros((4,3)), np.ones((6,))]
@@ -196,3 +307,478 @@ class TestH5Pack(unittest.TestCase):
             5: np.ones((1,2))
         }
         self.check_roundtrip_ndarrays(x)
+
+
+class TestLazy(unittest.TestCase):
+    """Test lazy unpacking into proxies that read from the file on demand"""
+    def run(self, result=None):
+        with tempfile.TemporaryDirectory() as tempdir:
+            self.filename = os.path.join(tempdir, 'tempfile')
+            super().run(result)
+
+    def test_lazy_dict(self):
+        x = {
+            'a': np.arange(20).reshape((4, 5)),
+            'b': [1, 'abc', (2.5, None)],
+            'c': {'x': 1.2, 'y': 3.5},
+            7: 'seven'
+        }
+        pack(x, self.filename)
+        with h5pack.open(self.filename) as x_:
+            self.assertIsInstance(x_, LazyDict)
+            self.assertEqual(set(x_.keys()), {'a', 'b', 'c', 7})
+            self.assertEqual(len(x_), 4)
+            self.assertEqual(x_[7], 'seven')
+            self.assertEqual(x_['c'], {'x': 1.2, 'y': 3.5})
+            self.assertNotIn('7', x_)
+
+            a = x_['a']
+            self.assertIsInstance(a, LazyArray)
+            self.assertEqual(a.shape, (4, 5))
+            np.testing.assert_array_equal(a[1:3, 2], x['a'][1:3, 2])
+            np.testing.assert_array_equal(np.asarray(a), x['a'])
+
+            b = x_['b']
+            self.assertIsInstance(b, LazyIndexed)
+            self.assertEqual(len(b), 3)
+            self.assertEqual(b[1], 'abc')
+            self.assertEqual(b[-1][0], 2.5)
+            self.assertEqual(b[:2], [1, 'abc'])
+            with self.assertRaises(IndexError):
+                b[3]
+            self.assertEqual(b.read(), x['b'])
+
+    def test_lazy_unpack(self):
+        x = [np.ones((3,)), {'a': [1, 2, 3]}]
+        pack(x, self.filename)
+        x_ = unpack(self.filename, lazy=True)
+        self.assertIsInstance(x_, LazyIndexed)
+        np.testing.assert_array_equal(x_[0][:], x[0])
+        self.assertEqual(x_[1]['a'], [1, 2, 3])
+
+    def test_lazy_primitive(self):
+        pack('abc', self.filename)
+        self.assertEqual(unpack(self.filename, lazy=True), 'abc')
+
+
+class TestPath(unittest.TestCase):
+    """Test reading a single item by key path"""
+    def run(self, result=None):
+        with tempfile.TemporaryDirectory() as tempdir:
+            self.filename = os.path.join(tempdir, 'tempfile')
+            super().run(result)
+
+    def test_path(self):
+        x = {
+            'results': [1, 'a', 2.5, {'weights': np.arange(6), 'name': 'w'}],
+            'ints': [10, 20, 30],
+            'strs': ('abc', 'de'),
+            'lookup': {'a': 1.5, 'bb': 2.5, 'c': 3.5},
+            'by_int': {3: 'c', 1: 'a', 2: 'b'},
+            'empty': {},
+            's': {1, 2},
+            5: 'five'
+        }
+        pack(x, self.filename)
+        np.testing.assert_array_equal(unpack(self.filename, path=('results', 3, 'weights')), np.arange(6))
+        self.assertEqual(unpack(self.filename, path=('results', -1, 'name')), 'w')
+        self.assertEqual(unpack(self.filename, path=('results', 1)), 'a')
+        self.assertEqual(set(unpack(self.filename, path=('results', 3)).keys()), {'weights', 'name'})
+        self.assertEqual(set(unpack(self.filename, path=()).keys()), set(x.keys()))
+        self.assertEqual(unpack(self.filename, path=(5,)), 'five')
+
+        # Items of homogeneous collections
+        self.assertEqual(unpack(self.filename, path=('ints', 1)), 20)
+        self.assertEqual(unpack(self.filename, path=('ints', -1)), 30)
+        self.assertEqual(unpack(self.filename, path=('strs', 0)), 'abc')
+        for k, v in x['lookup'].items():
+            self.assertEqual(unpack(self.filename, path=('lookup', k)), v)
+        for k, v in x['by_int'].items():
+            self.assertEqual(unpack(self.filename, path=('by_int', k)), v)
+
+        # Missing items
+        with self.assertRaises(KeyError):
+            unpack(self.filename, path=('nope',))
+        with self.assertRaises(KeyError):
+            unpack(self.filename, path=('5',))
+        with self.assertRaises(KeyError):
+            unpack(self.filename, path=('lookup', 'b'))
+        with self.assertRaises(KeyError):
+            unpack(self.filename, path=('lookup', 1))
+        with self.assertRaises(KeyError):
+            unpack(self.filename, path=('empty', 'a'))
+        with self.assertRaises(IndexError):
+            unpack(self.filename, path=('ints', 3))
+        with self.assertRaises(IndexError):
+            unpack(self.filename, path=('results', 4))
+        with self.assertRaises(TypeError):
+            unpack(self.filename, path=('s', 0))
+        with self.assertRaises(TypeError):
+            unpack(self.filename, path=('ints', 0, 0))
+
+    def test_path_lazy(self):
+        x = {'a': {'b': [np.zeros((3, 2)), 'x']}}
+        pack(x, self.filename)
+        with h5pack.open(self.filename, path=('a', 'b')) as b:
+            self.assertIsInstance(b, LazyIndexed)
+            self.assertEqual(b[0].shape, (3, 2))
+
+
+class TestPackOptions(unittest.TestCase):
+    """Test that dataset creation options end up in the file"""
+    def run(self, result=None):
+        with tempfile.TemporaryDirectory() as tempdir:
+            self.filename = os.path.join(tempdir, 'tempfile')
+            super().run(result)
+
+    def test_filters(self):
+        x = {'a': np.random.rand(1000), 'b': list(range(1000)), 'small': np.ones(3)}
+        pack(x, self.filename, compression='lzf', shuffle=True, fletcher32=True)
+        with h5py.File(self.filename, 'r') as f:
+            ds = f['root/a']
+            self.assertEqual(ds.compression, 'lzf')
+            self.assertTrue(ds.shuffle)
+            self.assertTrue(ds.fletcher32)
+            self.assertEqual(f['root/b'].compression, 'lzf')
+            self.assertIsNone(f['root/small'].chunks)  # Below min_size
+            self.assertIsNone(f['root/small'].compression)
+        x_ = unpack(self.filename)
+        np.testing.assert_array_equal(x_['a'], x['a'])
+        self.assertEqual(x_['b'], x['b'])
+
+    def test_scaleoffset(self):
+        x = {'s': ['abc'] * 1000, 'f': np.linspace(0, 1, 1000), 'i': list(range(1000)), 'ragged': [[1.5] * 300] * 4,
+             'promoted': [1, 2.5, None] * 300, 'keys': {i * 0.001: i for i in range(1000)}}
+        pack(x, self.filename, scaleoffset=2, promote=True)
+        with h5py.File(self.filename, 'r') as f:
+            self.assertEqual(f['root/f'].scaleoffset, 2)
+            self.assertEqual(f['root/i'].scaleoffset, 2)
+            self.assertIsNone(f['root/s'].scaleoffset)  # HDF5 only supports ints and floats
+            self.assertEqual(f['root/ragged/values'].scaleoffset, 2)
+            self.assertIsNone(f['root/ragged/offsets'].scaleoffset)  # Lossy, so not for indexes
+            self.assertIsNone(f['root/promoted/tags'].scaleoffset)
+            self.assertIsNone(f['root/keys/keys'].scaleoffset)
+        x_ = unpack(self.filename)
+        self.assertEqual(x_['s'], x['s'])
+        np.testing.assert_allclose(x_['f'], x['f'], atol=0.01)
+        self.assertEqual(list(x_['keys']), list(x['keys']))  # Vals are ints cut to 2 bits
+        self.assertEqual(list(map(type, x_['promoted'])), list(map(type, x['promoted'])))
+
+    def test_gzip_level_chunks(self):
+        pack(np.zeros((100, 50)), self.filename, compression_opts=9, chunks=(10, 50), min_size=0)
+        with h5py.File(self.filename, 'r') as f:
+            ds = f['root']
+            self.assertEqual(ds.compression, 'gzip')
+            self.assertEqual(ds.compression_opts, 9)
+            self.assertEqual(ds.chunks, (10, 50))
+
+    def test_no_compression(self):
+        pack(np.zeros(1000), self.filename, compression=False)
+        with h5py.File(self.filename, 'r') as f:
+            self.assertIsNone(f['root'].compression)
+            self.assertIsNone(f['root'].chunks)
+
+        # Also positional, as in the original pack(data, filename, compression=True)
+        pack(np.zeros(1000), self.filename, False)
+        with h5py.File(self.filename, 'r') as f:
+            self.assertIsNone(f['root'].compression)
+        with h5py.File(io.BytesIO(packb(np.zeros(1000), False)), 'r') as f:
+            self.assertIsNone(f['root'].compression)
+
+    def test_policy(self):
+        def policy(path, data):
+            if path == '/root/raw':
+                return {'compression': None}
+            elif data.dtype == np.float32:
+                return {'compression': 'lzf'}
+
+        x = {'raw': np.zeros(1000), 'f32': np.zeros(1000, dtype=np.float32), 'f64': np.zeros(1000)}
+        pack(x, self.filename, policy=policy)
+        with h5py.File(self.filename, 'r') as f:
+            self.assertIsNone(f['root/raw'].compression)
+            self.assertEqual(f['root/f32'].compression, 'lzf')
+            self.assertEqual(f['root/f64'].compression, 'gzip')
+
+    def test_workers(self):
+        x = {
+            'a': np.random.rand(300, 200),
+            'b': np.arange(100000, dtype=np.int16).reshape((1000, 100)),  # Odd edge chunks
+            'c': np.random.rand(5000) > 0.5,
+            'd': list(range(5000)),
+            'e': np.random.rand(5000).astype(np.float32)
+        }
+        for shuffle in (False, True):
+            pack(x, self.filename, workers=3, shuffle=shuffle, compression_opts=6, chunks=True)
+            with h5py.File(self.filename, 'r') as f:  # Plain HDF5 read
+                ds = f['root/b']
+                self.assertEqual(ds.compression, 'gzip')
+                self.assertEqual(ds.compression_opts, 6)
+                self.assertEqual(ds.shuffle, shuffle)
+                np.testing.assert_array_equal(ds[...], x['b'])
+            x_ = unpack(self.filename)
+            for k in ('a', 'b', 'c', 'e'):
+                np.testing.assert_array_equal(x_[k], x[k])
+            self.assertEqual(x_['d'], x['d'])
+
+    def test_unpack_workers(self):
+        x = {
+            'a': np.random.rand(300, 200),
+            'b': np.arange(100000, dtype=np.int16).reshape((1000, 100)),
+            'c': np.random.rand(5000) > 0.5,
+            'd': np.ones(100),
+        }
+        for shuffle in (False, True):
+            pack(x, self.filename, shuffle=shuffle, chunks=True)
+            x_ = unpack(self.filename, workers=3)
+            for k in x:
+                np.testing.assert_array_equal(x_[k], x[k])
+                self.assertEqual(x_[k].dtype, x[k].dtype)
+
+        # Chunks that were never written
+        with h5py.File(self.filename, 'w') as f:
+            ds = f.create_dataset('root', shape=(100, 10), chunks=(10, 10), dtype=np.float64, compression='gzip',
+                                  fillvalue=7)
+            ds[15:25] = 1
+            ds.attrs['data_type'] = 'ndarray'
+            ds.attrs['collection_type'] = 'primitive'
+            expected = ds[...]
+        np.testing.assert_array_equal(unpack(self.filename, workers=2), expected)
+
+    def test_mmap(self):
+        x = {'a': np.random.rand(300, 200), 'b': np.arange(1000, dtype=np.int16), 'c': list(range(1000)), 'd': np.zeros(0)}
+        pack(x, self.filename, contiguous=True)
+        with h5py.File(self.filename, 'r') as f:
+            self.assertIsNone(f['root/a'].chunks)
+            self.assertIsNone(f['root/a'].compression)
+            self.assertEqual(f['root/c'].compression, 'gzip')  # Only ndarrays are affected
+        x_ = unpack(self.filename, mmap=True)
+        for k in ('a', 'b'):
+            self.assertIsInstance(x_[k], np.memmap)
+            self.assertFalse(x_[k].flags.writeable)
+            np.testing.assert_array_equal(x_[k], x[k])
+        self.assertEqual(x_['c'], x['c'])
+        self.assertEqual(x_['d'].shape, (0,))
+
+        with h5pack.open(self.filename, mmap=True) as x_:
+            self.assertIsInstance(x_['a'], np.memmap)
+
+        # Offsets already count a userblock
+        userblock_filename = self.filename + '-userblock'
+        with h5py.File(self.filename, 'r') as f, h5py.File(userblock_filename, 'w', userblock_size=512) as f_:
+            f.copy(f['root'], f_)
+        x_ = unpack(userblock_filename, mmap=True)
+        self.assertIsInstance(x_['a'], np.memmap)
+        np.testing.assert_array_equal(x_['a'], x['a'])
+
+        # Compressed arrays can't be memory-mapped
+        pack(x, self.filename)
+        x_ = unpack(self.filename, mmap=True)
+        self.assertNotIsInstance(x_['a'], np.memmap)
+        np.testing.assert_array_equal(x_['a'], x['a'])
+
+
+class TestDedup(unittest.TestCase):
+    """Test storing identical arrays and lists once with pack(dedup=True)"""
+    def run(self, result=None):
+        with tempfile.TemporaryDirectory() as tempdir:
+            self.filename = os.path.join(tempdir, 'tempfile')
+            super().run(result)
+
+    def test_dedup(self):
+        emb = np.random.rand(1000, 50)
+        names = ['a', 'b', 'c']
+        x = {'v1': {'emb': emb, 'names': names}, 'v2': {'emb': emb.copy(), 'names': list(names)},
+             'list': [emb, 1, ('a', 'b', 'c')], 3: emb, 'ints': [1, 2, 3], 'floats': [1.0, 2.0, 3.0]}
+        pack(x, self.filename, dedup=True)
+        size_dedup = os.path.getsize(self.filename)
+        with h5py.File(self.filename, 'r') as f:
+            self.assertEqual(h5py.h5o.get_info(f['root/v1/emb'].id).rc, 3)
+            self.assertEqual(h5py.h5o.get_info(f['root/v1/names'].id).rc, 2)
+            self.assertEqual(h5py.h5o.get_info(f['root/list/2'].id).rc, 1)  # tuple isn't the same as list
+            self.assertEqual(h5py.h5o.get_info(f['root/ints'].id).rc, 1)
+            self.assertEqual(f['root/3'].attrs['key_type'], 'int')  # A copy, since attrs differ from the str keys'
+
+        x_ = unpack(self.filename)
+        self.assertIs(x_['v1']['emb'], x_['v2']['emb'])
+        self.assertIs(x_['v1']['emb'], x_['list'][0])
+        self.assertIsNot(x_['v1']['emb'], x_[3])
+        self.assertIs(x_['v1']['names'], x_['v2']['names'])
+        np.testing.assert_array_equal(x_[3], emb)
+        self.assertEqual(x_['list'][2], ('a', 'b', 'c'))
+        self.assertEqual(x_['ints'], [1, 2, 3])
+        self.assertEqual(x_['floats'], [1.0, 2.0, 3.0])
+
+        pack(x, self.filename, dedup=True, compact=True, inline_scalars=True)
+        with h5py.File(self.filename, 'r') as f:
+            self.assertTrue(read_meta(f['root'])['dedup'])
+        x_ = unpack(self.filename)
+        self.assertIs(x_['v1']['emb'], x_['list'][0])
+        self.assertEqual(x_['list'][1], 1)
+
+        pack(x, self.filename)
+        self.assertLess(size_dedup, 0.6 * os.path.getsize(self.filename))  # 2 copies of emb instead of 4
+        with h5py.File(self.filename, 'r') as f:
+            self.assertNotIn('dedup', f['root'].attrs)  # So unpack doesn't look for links
+
+
+class TestPromote(unittest.TestCase):
+    """Test storing mixed numbers and Nones as 1 dataset with pack(promote=True)"""
+    def run(self, result=None):
+        with tempfile.TemporaryDirectory() as tempdir:
+            self.filename = os.path.join(tempdir, 'tempfile')
+            super().run(result)
+
+    def test_promote(self):
+        x = {
+            'mixed': [1, 2.5, True, None, 3],
+            'tuple': (None, 1.5),
+            'strs': ['a', None, 'bc'],
+            'nones': [None, None],
+            'dict': {'a': 1, 'b': 2.5, 'c': None, 'd': False},
+            'big': [2 ** 60, 0.5],  # Can't be promoted exactly
+            'nested': [[1, 2.0], {3: None, 4: 1}],
+            'uint': [2 ** 63, None],  # Too big for int64
+            'bool_uint': [True, 2 ** 63],
+            'dict_uint': {'a': 2 ** 63, 'b': None},
+            'mixed_uint': [-1, 2 ** 63, None],
+        }
+        pack(x, self.filename, promote=True)
+        with h5py.File(self.filename, 'r') as f:
+            self.assertEqual(f['root/mixed'].attrs['collection_type'], 'promoted')
+            self.assertEqual(f['root/mixed/vals'].dtype, np.float64)
+            self.assertEqual(f['root/strs'].attrs['collection_type'], 'promoted')
+            self.assertTrue(f['root/dict'].attrs['homogeneous'])
+            self.assertEqual(f['root/big'].attrs['collection_type'], 'list')
+            for k in ('uint', 'bool_uint', 'dict_uint', 'mixed_uint'):
+                self.assertNotEqual(f['root'][k].attrs['collection_type'], 'promoted')
+
+        x_ = unpack(self.filename)
+        self.assertEqual(x_, x)
+        for k in ('mixed', 'tuple', 'strs', 'nones', 'big', 'uint', 'bool_uint', 'mixed_uint'):
+            self.assertEqual(list(map(type, x_[k])), list(map(type, x[k])))
+        self.assertEqual(list(map(type, x_['dict'].values())), [int, float, type(None), bool])
+
+        self.assertIs(unpack(self.filename, path=('mixed', 2)), True)
+        self.assertIs(unpack(self.filename, path=('mixed', -2)), None)
+        self.assertEqual(unpack(self.filename, path=('strs', 2)), 'bc')
+        self.assertIs(unpack(self.filename, path=('dict', 'a')), 1)
+        with self.assertRaises(IndexError):
+            unpack(self.filename, path=('mixed', 5))
+
+        update(self.filename, ('dict', 'a'), 1.0)
+        self.assertIs(type(unpack(self.filename, path=('dict', 'a'))), float)
+
+
+class TestMetadata(unittest.TestCase):
+    """Test the layouts of node metadata: compact JSON attrs and inlined dict scalars"""
+    def run(self, result=None):
+        with tempfile.TemporaryDirectory() as tempdir:
+            self.filename = os.path.join(tempdir, 'tempfile')
+            super().run(result)
+
+    def test_compact(self):
+        x = {'a': [1, 'b', None], 'c': {1: 2.5, 'd': (1, 2)}, 'e': [{'f': i} for i in range(3)], 'g': {'h': 1},
+             'i': [np.arange(i) for i in range(3)], 'j': {1, 'k'}}
+        pack(x, self.filename, compact=True)
+        with h5py.File(self.filename, 'r') as f:
+            self.assertEqual(list(f['root/c/1'].attrs), ['h5pack'])
+            self.assertEqual(json.loads(f['root/c/1'].attrs['h5pack']),
+                             {'data_type': 'float', 'collection_type': 'primitive', 'key_type': 'int'})
+        x_ = unpack(self.filename)
+        np.testing.assert_array_equal(x_.pop('i')[2], x.pop('i')[2])
+        self.assertEqual(x_, x)
+        self.assertEqual(unpack(self.filename, path=('c', 'd', 1)), 2)
+        self.assertEqual(unpack(self.filename, path=('e', 2, 'f')), 2)
+        with h5pack.open(self.filename) as x_:
+            self.assertEqual(dict(x_['c']), {1: 2.5, 'd': (1, 2)})
+
+    def test_inline_scalars(self):
+        x = {'lr': 0.1, 'name': 'run7', 'epochs': 10, 'seed': None, 'debug': False, 3: 'three', 'nan': float('nan'),
+             'w': np.arange(3), 'layers': [64, 'relu'], 'opt': {'beta': 0.9, 'amsgrad': False}}
+        for compact in [False, True]:
+            pack(x, self.filename, inline_scalars=True, compact=compact)
+            with h5py.File(self.filename, 'r') as f:
+                self.assertEqual(sorted(f['root']), ['layers', 'opt', 'w'])
+                self.assertEqual(len(f['root/opt']), 0)
+            x_ = unpack(self.filename)
+            np.testing.assert_array_equal(x_.pop('w'), x['w'])
+            self.assertTrue(np.isnan(x_.pop('nan')))
+            self.assertEqual(x_, {k: v for k, v in x.items() if k not in ('w', 'nan')})
+            self.assertIsInstance(x_['epochs'], int)
+            self.assertEqual(unpack(self.filename, path=(3,)), 'three')
+            self.assertEqual(unpack(self.filename, path=('opt', 'amsgrad')), False)
+            with self.assertRaises(KeyError):
+                unpack(self.filename, path=('3',))
+            with self.assertRaises(TypeError):
+                unpack(self.filename, path=('name', 0))
+            with h5pack.open(self.filename) as x_:
+                self.assertEqual(len(x_), len(x))
+                self.assertEqual(set(x_), set(x))
+                self.assertIs(x_['seed'], None)
+                self.assertEqual(x_['layers'][1], 'relu')
+
+        # Long strs only fill up to the limit, and the rest are stored as datasets
+        x = {'s{}'.format(i): 'x' * 1000 for i in range(100)}
+        pack(x, self.filename, inline_scalars=True)
+        with h5py.File(self.filename, 'r') as f:
+            self.assertTrue(0 < len(f['root']) < 100)
+        self.assertEqual(unpack(self.filename), x)
+
+
+class TestStats(unittest.TestCase):
+    """Test recording per-node stats of pack and unpack"""
+    def run(self, result=None):
+        with tempfile.TemporaryDirectory() as tempdir:
+            self.filename = os.path.join(tempdir, 'tempfile')
+            super().run(result)
+
+    def test_stats(self):
+        x = {'a': np.arange(1000.0), 'b': [1, 'c', {'d': [1, 2, 3]}], 'e': [{'f': i} for i in range(5)]}
+        x['g'] = x['a']
+        stats = Stats()
+        pack(x, self.filename, dedup=True, stats=stats)
+        self.assertEqual(unpack(self.filename, path=('b', 2), stats=stats), {'d': [1, 2, 3]})
+
+        report = stats.report(top=2)
+        self.assertEqual(report['pack']['nodes'], 9)
+        self.assertEqual(report['unpack']['nodes'], 2)
+        self.assertEqual(report['pack']['encodings']['link']['nodes'], 1)
+        self.assertEqual(report['pack']['encodings']['records']['objects'], 2)
+        self.assertEqual(report['pack']['encodings']['ndarray']['bytes_in'], 8000)
+        self.assertEqual(set(report['pack']['phases']), {'encode', 'datasets', 'other'})
+        self.assertEqual(len(report['pack']['slowest']), 2)
+        paths = {node['path'] for node in stats.nodes}
+        self.assertIn('/root/b/2/d', paths)
+
+        root = [node for node in stats.nodes if node['path'] == '/root' and node['op'] == 'pack'][0]
+        self.assertAlmostEqual(root['time'], report['pack']['time'])
+        self.assertAlmostEqual(sum(node['self_time'] for node in stats.nodes if node['op'] == 'pack'), root['time'])
+        self.assertEqual(json.loads(stats.to_json(nodes=True))['nodes'], stats.nodes)
+
+
+class TestInMemory(unittest.TestCase):
+    """Test packing to/from bytes and file-like objects"""
+    x = {'a': np.arange(1000), 'b': [1, 'abc', None], 'c': {'x': 1.5}}
+
+    def check_x(self, x_):
+        np.testing.assert_array_equal(x_['a'], self.x['a'])
+        self.assertEqual(x_['b'], self.x['b'])
+        self.assertEqual(x_['c'], self.x['c'])
+
+    def test_bytes(self):
+        buf = packb(self.x, compression=False)
+        self.assertIsInstance(buf, bytes)
+        self.assertEqual(buf[:8], b'\x89HDF\r\n\x1a\n')
+        self.check_x(unpackb(buf))
+        self.assertEqual(unpackb(buf, path=('b', 1)), 'abc')
+        self.assertEqual(unpackb(buf, lazy=True)['b'][1], 'abc')
+        self.assertEqual(unpackb(bytearray(buf), path=('c',)), self.x['c'])
+
+    def test_file_like(self):
+        f = io.BytesIO()
+        pack(self.x, f)
+        self.check_x(unpackb(f.getvalue()))
+        f.seek(0)
+        x_ = unpack(f, mmap=True)
+        self.check_x(x_)
+        self.assertNotIsInstance(x_['a'], np.memmap)
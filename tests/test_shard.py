@@ -0,0 +1,105 @@
+import unittest
+import tempfile
+import os
+import shutil
+import numpy as np
+import h5py
+from h5pack import pack, unpack, pack_sharded
+from h5pack.h5pack import read_opts, read_path
+from h5pack.shard import shard_filename
+
+
+class TestShard(unittest.TestCase):
+    """Test packs split across a master file and shard files"""
+    def run(self, result=None):
+        with tempfile.TemporaryDirectory() as tempdir:
+            self.tempdir = tempdir
+            self.filename = os.path.join(tempdir, 'out.h5')
+            super().run(result)
+
+    def shards(self):
+        return sorted(name for name in os.listdir(self.tempdir) if name != 'out.h5')
+
+    def test_dict(self):
+        x = {'a': np.arange(1000.0), 'b': list(range(300)), 'c': 'text', 'd': {'e': [1, 'two']}, 3: 4.5,
+             'big': np.arange(5000).reshape(1000, 5)}
+        pack(x, self.filename, shard_size=10000)
+        self.assertEqual(self.shards(), ['out-{:05d}.h5'.format(i) for i in range(6)])
+
+        with h5py.File(self.filename, 'r') as f:
+            root = f['root']
+            self.assertIsInstance(root.get('a', getlink=True), h5py.ExternalLink)
+            self.assertIsInstance(root.get('c', getlink=True), h5py.ExternalLink)
+            self.assertTrue(root['big'].is_virtual)
+            self.assertEqual(len(root['big'].virtual_sources()), 4)
+
+        x_ = unpack(self.filename)
+        self.assertEqual(set(x_), set(x))
+        np.testing.assert_array_equal(x_['a'], x['a'])
+        np.testing.assert_array_equal(x_['big'], x['big'])
+        self.assertEqual(x_['b'], x['b'])
+        self.assertEqual(x_['d'], x['d'])
+        self.assertEqual(x_[3], 4.5)
+        with h5py.File(self.filename, 'r') as f:
+            self.assertEqual(read_path(f, 'root', ['d', 'e', 1], read_opts()), 'two')
+
+        # Files can be moved together
+        moved = os.path.join(self.tempdir, 'moved')
+        os.mkdir(moved)
+        for name in os.listdir(self.tempdir):
+            if name != 'moved':
+                shutil.move(os.path.join(self.tempdir, name), moved)
+        np.testing.assert_array_equal(unpack(os.path.join(moved, 'out.h5'))['big'], x['big'])
+
+    def test_list(self):
+        x = [np.ones(100) * i for i in range(10)] + ['a', None]
+        pack_sharded(x, self.filename, 2000, processes=2, compression=False)
+        self.assertEqual(len(self.shards()), 5)
+        x_ = unpack(self.filename)
+        self.assertEqual(len(x_), len(x))
+        for item, item_ in zip(x[:10], x_[:10]):
+            np.testing.assert_array_equal(item_, item)
+        self.assertEqual(x_[10:], ['a', None])
+
+    def test_array(self):
+        x = np.random.default_rng(0).random((100, 3))
+        pack(x, self.filename, shard_size=1000, contiguous=True)
+        self.assertEqual(len(self.shards()), 3)  # 41 rows each
+        np.testing.assert_array_equal(unpack(self.filename), x)
+        np.testing.assert_array_equal(unpack(self.filename, mmap=True), x)
+
+    def test_not_sharded(self):
+        for x in [list(range(1000)), {'a': 1, 'b': 2}, np.ones(10), 'text']:
+            pack(x, self.filename, shard_size=100)
+            self.assertEqual(self.shards(), [])
+            x_ = unpack(self.filename)
+            if isinstance(x, np.ndarray):
+                np.testing.assert_array_equal(x_, x)
+            else:
+                self.assertEqual(x_, x)
+
+    def test_dedup(self):
+        a1 = np.arange(1000.0)
+        a2 = np.arange(1000.0) + 5
+        x = {'a': [a1, a1, 'x'], 'b': [a2, a2, 'y']}
+        pack(x, self.filename, shard_size=8000, dedup=True)
+        self.assertEqual(len(self.shards()), 2)
+        x_ = unpack(self.filename)
+        np.testing.assert_array_equal(x_['a'][0], a1)
+        np.testing.assert_array_equal(x_['b'][0], a2)  # Same address as a1, in another file
+        self.assertIs(x_['a'][0], x_['a'][1])
+        self.assertIs(x_['b'][0], x_['b'][1])
+
+    def test_positional_compression(self):
+        pack([np.zeros(1000), 'a'], self.filename, False)  # compression=False, not shard_size=False
+        self.assertEqual(self.shards(), [])
+        with h5py.File(self.filename, 'r') as f:
+            self.assertIsNone(f['root/0'].compression)
+
+    def test_shard_filename(self):
+        self.assertEqual(shard_filename('data/out.h5', 12), 'data/out-00012.h5')
+        self.assertEqual(shard_filename('out', 0), 'out-00000')
+
+
+if __name__ == '__main__':
+    unittest.main()
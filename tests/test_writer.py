@@ -0,0 +1,171 @@
+import unittest
+import tempfile
+import os
+import subprocess
+import sys
+import numpy as np
+import h5py
+import h5pack
+from h5pack import pack, unpack, Writer
+from h5pack.h5pack import LazyList
+
+
+class TestWriter(unittest.TestCase):
+    """Test building up a pack incrementally with Writer"""
+    def run(self, result=None):
+        with tempfile.TemporaryDirectory() as tempdir:
+            self.filename = os.path.join(tempdir, 'tempfile')
+            super().run(result)
+
+    def test_append(self):
+        with Writer(self.filename, chunk_size=4) as w:
+            w['config'] = {'lr': 0.1, 'name': 'run7'}
+            for i in range(10):
+                w.append('losses', i * 0.5)
+                w.append('steps', i)
+                w.append('names', 'x' * i)  # Has to widen
+                w.append('flags', i % 2 == 0)
+                w.append('arrays', np.ones(i))
+                w.append(3, [i])
+            w.flush()
+            w.extend('losses', [5.0, 5.5])
+
+        with h5py.File(self.filename, 'r') as f:
+            self.assertEqual(f['root/losses'].maxshape, (None,))
+            self.assertEqual(f['root/losses'].chunks, (4,))
+
+        x_ = unpack(self.filename)
+        self.assertEqual(x_['config'], {'lr': 0.1, 'name': 'run7'})
+        self.assertEqual(x_['losses'], [i * 0.5 for i in range(12)])
+        self.assertEqual(x_['steps'], list(range(10)))
+        self.assertEqual(x_['names'], ['x' * i for i in range(10)])
+        self.assertEqual(x_['flags'], [i % 2 == 0 for i in range(10)])
+        self.assertEqual(len(x_['arrays']), 10)
+        np.testing.assert_array_equal(x_['arrays'][9], np.ones(9))
+        self.assertEqual(x_[3], [[i] for i in range(10)])
+
+    def test_append_other_type(self):
+        with Writer(self.filename) as w:
+            w.extend('a', [1, 2])
+            w.append('a', 'three')
+            w.append('a', 4)
+        self.assertEqual(unpack(self.filename), {'a': [1, 2, 'three', 4]})
+
+    def test_resume(self):
+        pack({'a': [1, 2], 'b': [], 'c': 'abc'}, self.filename)
+        with Writer(self.filename, mode='a') as w:
+            w.append('a', 3)
+            w.append('b', 1.5)
+            w.write('c', 'def')
+            w.append('d', 'x')
+        self.assertEqual(unpack(self.filename), {'a': [1, 2, 3], 'b': [1.5], 'c': 'def', 'd': ['x']})
+
+        with Writer(self.filename, mode='a') as w:
+            with self.assertRaises(ValueError):
+                w.append('c', 'ghi')
+
+    def test_resume_packed_lists(self):
+        x = {'r': [{'x': 1}, {'x': 2}], 'l': [[1], [2, 3]], 't': ({'x': 1}, {'x': 2})}
+        pack(x, self.filename)
+        with Writer(self.filename, mode='a') as w:
+            w.append('r', {'x': 3})
+            w.extend('l', [[4], 'five'])
+            with self.assertRaises(ValueError):
+                w.append('t', {'x': 3})  # Tuples can't be appended to
+        self.assertEqual(unpack(self.filename), {'r': [{'x': 1}, {'x': 2}, {'x': 3}], 'l': [[1], [2, 3], [4], 'five'],
+                                                 't': x['t']})
+
+        pack({'l': [1, 2.5, None]}, self.filename, promote=True)
+        with Writer(self.filename, mode='a') as w:
+            w.append('l', 3)
+        self.assertEqual(unpack(self.filename), {'l': [1, 2.5, None, 3]})
+
+    def test_append_strs(self):
+        with Writer(self.filename) as w:
+            w.extend('a', ['x', 'yz'])
+            w.append('a', 'wide' * 10)
+            w.append('a', 'ñ')
+            w.append('a', 'b')
+        self.assertEqual(unpack(self.filename), {'a': ['x', 'yz', 'wide' * 10, 'ñ', 'b']})
+
+    def test_inline_scalars(self):
+        with Writer(self.filename, inline_scalars=True) as w:
+            w['lr'] = 0.1
+            w['name'] = 'run'
+            w['lr'] = 0.01
+            w.append('losses', 1.5)
+            w['name'] = [1, 2]
+            with self.assertRaises(ValueError):
+                w.append('lr', 1.0)
+        self.assertEqual(unpack(self.filename), {'lr': 0.01, 'losses': [1.5], 'name': [1, 2]})
+        with h5py.File(self.filename, 'r') as f:
+            self.assertEqual(sorted(f['root']), ['losses', 'name'])
+
+    def test_swmr(self):
+        w = Writer(self.filename, swmr=True)
+        w['config'] = {'lr': 0.1, 'name': 'run'}
+        w.create_list('losses', float)
+        w.create_list('events', str, str_len=8)
+        w.extend('steps', [0, 1])
+        w.start_swmr()
+        w.append('losses', 1.5)
+        w.append('events', 'début')
+
+        with h5pack.open(self.filename, swmr=True) as x:
+            self.assertEqual(x['config'], {'lr': 0.1, 'name': 'run'})
+            losses = x['losses']
+            self.assertIsInstance(losses, LazyList)
+            self.assertEqual(list(losses), [1.5])
+            w.extend('losses', [1.25, 1.0])
+            w.append('steps', 2)
+            self.assertEqual(losses.refresh(), 3)
+            self.assertEqual(losses[1:], [1.25, 1.0])
+            self.assertEqual(losses[-1], 1.0)
+            self.assertEqual(x['steps'][:], [0, 1, 2])
+            events = x['events']
+            w.extend('events', ['a', 'bb', 'ccc'])
+            events.refresh()
+            self.assertEqual(events[::2], ['début', 'bb'])
+            self.assertEqual(events[1::2], ['a', 'ccc'])
+            self.assertEqual(losses[::-2], [1.0, 1.5])
+        self.assertEqual(unpack(self.filename, path=('events',), swmr=True), ['début', 'a', 'bb', 'ccc'])
+
+        reader = 'from h5pack import unpack; print(unpack({!r}, swmr=True)["losses"])'.format(self.filename)
+        out = subprocess.run([sys.executable, '-c', reader], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(out.strip(), '[1.5, 1.25, 1.0]')
+
+        with self.assertRaises(ValueError):
+            w.append('events', 'much too long')
+        with self.assertRaises(ValueError):
+            w.append('losses', 'x')
+        with self.assertRaises(ValueError):
+            w.append('new', 1)
+        with self.assertRaises(ValueError):
+            w['config'] = None
+        w.close()
+        self.assertEqual(unpack(self.filename)['losses'], [1.5, 1.25, 1.0])
+
+        with Writer(self.filename) as w:
+            with self.assertRaises(ValueError):
+                w.start_swmr()
+
+    def test_dedup(self):
+        emb = np.arange(1000.0)
+        with Writer(self.filename, dedup=True) as w:
+            w['a'] = emb
+            w['b'] = emb.copy()
+        x_ = unpack(self.filename)
+        self.assertIs(x_['a'], x_['b'])
+        np.testing.assert_array_equal(x_['a'], emb)
+
+    def test_scaleoffset(self):
+        with Writer(self.filename, scaleoffset=0) as w:
+            w.create_list('names', str)
+            w.extend('names', ['a', 'bb'])
+            w.extend('steps', [1, 2])
+        self.assertEqual(unpack(self.filename), {'names': ['a', 'bb'], 'steps': [1, 2]})
+
+    def test_resume_not_dict(self):
+        pack([1, 2], self.filename)
+        with self.assertRaises(ValueError):
+            Writer(self.filename, mode='a')